@@ -0,0 +1,88 @@
+import asyncio
+import time
+import traceback
+from typing import Any, Tuple
+
+import anthropic
+
+from .clients import shared_async_client
+from .main import BashSession, EditorSession, UnifiedSession
+
+
+class AsyncSessionMixin:
+    """Async agent loop on top of AsyncAnthropic.
+
+    Reuses the bookkeeping of AgentSession; blocking tool execution is
+    offloaded to a thread so the event loop keeps serving other sessions.
+    Sessions on one event loop share its AsyncAnthropic and connection pool.
+    """
+
+    @property
+    def async_client(self) -> anthropic.AsyncAnthropic:
+        return shared_async_client()
+
+    async def _acreate(self) -> Tuple[Any, bool]:
+        """Return the next response and whether it was replayed from the cache"""
+        params = self._message_params()
+        key, response = self._replay_response(params)
+        if response is not None:
+            return response, True
+        started = time.perf_counter()
+        response, reservation = await self.scheduler.acreate(self.async_client, params)
+        self.scheduler.settle(reservation, response.usage)
+        self._record_api_call(started, response, reservation=reservation)
+        self._store_response(key, response)
+        return response, False
+
+    async def arun(self, prompt: str) -> Tuple[str, str]:
+        """Run the agent loop for a prompt
+
+        Returns the final assistant text and whether the session completed
+        or stopped on a tool error.
+        """
+        try:
+            self._start_conversation(prompt)
+            final_text = ""
+            status = "completed"
+
+            while True:
+                response, replayed = await self._acreate()
+                self._record_response(response, replayed)
+
+                if response.stop_reason != "tool_use":
+                    final_text = self._response_text(response)
+                    break
+
+                tool_results = await asyncio.to_thread(
+                    self.process_tool_calls, response.content
+                )
+                if self._record_tool_results(tool_results):
+                    status = "stopped"
+                    break
+
+            self._set_status(status)
+            # After the execution loop, log the total cost
+            self.session_logger.log_total_cost()
+            return final_text, status
+
+        except Exception as e:
+            self._set_status("failed")
+            self.logger.error(f"Error in arun: {str(e)}")
+            self.logger.error(traceback.format_exc())
+            raise
+
+    async def aclose(self) -> None:
+        """Close the session; the shared async client stays open"""
+        await asyncio.to_thread(self.close)
+
+
+class AsyncEditorSession(AsyncSessionMixin, EditorSession):
+    pass
+
+
+class AsyncBashSession(AsyncSessionMixin, BashSession):
+    pass
+
+
+class AsyncUnifiedSession(AsyncSessionMixin, UnifiedSession):
+    pass
@@ -0,0 +1,124 @@
+import asyncio
+import json
+from typing import Any, Dict, List, Optional
+
+from .async_session import AsyncBashSession, AsyncEditorSession, AsyncUnifiedSession
+from .clients import close_async_client, shared_async_client
+from .main import SESSION_MODES, SESSIONS_DIR, SessionLogger, new_session_id
+
+
+def load_jobs(path: str, default_mode: str) -> List[Dict[str, Any]]:
+    """Read batch jobs from a JSONL file.
+
+    Each line is either a JSON string (the prompt) or an object with a
+    `prompt` and optional `mode` and `id`.
+    """
+    jobs = []
+    with open(path, "r") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            job = json.loads(line)
+            if isinstance(job, str):
+                job = {"prompt": job}
+            if not isinstance(job, dict):
+                raise ValueError(
+                    f"{path}:{line_number}: expected a prompt string or an object"
+                )
+            if "prompt" not in job:
+                raise ValueError(f"{path}:{line_number}: missing 'prompt'")
+            job.setdefault("mode", default_mode)
+            if job["mode"] not in SESSION_MODES:
+                raise ValueError(
+                    f"{path}:{line_number}: unknown mode {job['mode']!r} "
+                    f"(expected one of {', '.join(SESSION_MODES)})"
+                )
+            job.setdefault("id", str(line_number))
+            jobs.append(job)
+    return jobs
+
+
+async def _run_job(
+    job: Dict[str, Any],
+    semaphore: asyncio.Semaphore,
+    session_options: Dict[str, Any],
+    log_options: Dict[str, Any],
+    settings: Dict[str, Any],
+    sessions_dir: str,
+    editor_dir: Optional[str],
+) -> Dict[str, Any]:
+    async with semaphore:
+        session_id = new_session_id()
+        session_logger = SessionLogger(session_id, sessions_dir, **log_options)
+
+        if job["mode"] == "bash":
+            session = AsyncBashSession(
+                session_id=session_id, sessions_dir=sessions_dir, **session_options
+            )
+        elif job["mode"] == "combined":
+            # The shell of a combined session always starts in editor_dir
+            options = {k: v for k, v in session_options.items() if k != "cwd"}
+            session = AsyncUnifiedSession(
+                session_id=session_id,
+                editor_dir=editor_dir,
+                sessions_dir=sessions_dir,
+                **options,
+            )
+        else:
+            session = AsyncEditorSession(
+                session_id=session_id, editor_dir=editor_dir, sessions_dir=sessions_dir
+            )
+        session.configure(**settings)
+        session.set_logger(session_logger)
+
+        result = {"id": job["id"], "session_id": session_id, "mode": job["mode"]}
+        try:
+            result["output"], status = await session.arun(job["prompt"])
+            result["status"] = "ok" if status == "completed" else status
+        except Exception as e:
+            result["error"] = str(e)
+            result["status"] = "error"
+        finally:
+            await session.aclose()
+            session_logger.close()
+        return result
+
+
+async def run_batch(
+    jobs: List[Dict[str, Any]],
+    concurrency: int,
+    log_options: Optional[Dict[str, Any]] = None,
+    settings: Optional[Dict[str, Any]] = None,
+    sessions_dir: str = SESSIONS_DIR,
+    editor_dir: Optional[str] = None,
+    **session_options: Any,
+) -> List[Dict[str, Any]]:
+    """Run independent sessions concurrently, at most `concurrency` at a time.
+
+    `log_options` are passed to each SessionLogger, `settings` to every
+    session's configure() and `session_options` to bash sessions (e.g.
+    no_agi). All sessions share one AsyncAnthropic, and so one connection
+    pool. Results are returned in job order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    log_options = log_options or {}
+    settings = settings or {}
+    shared_async_client()
+    try:
+        return await asyncio.gather(
+            *(
+                _run_job(
+                    job,
+                    semaphore,
+                    session_options,
+                    log_options,
+                    settings,
+                    sessions_dir,
+                    editor_dir,
+                )
+                for job in jobs
+            )
+        )
+    finally:
+        await close_async_client()
@@ -0,0 +1,420 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from .mock_api import MockMessagesServer, Turn
+
+DEFAULT_LATENCY = 0.0
+DEFAULT_TOLERANCE = 0.25
+
+# Regressions smaller than these are treated as noise
+_SLACK = {"overhead_per_turn_ms": 0.5, "peak_rss_mb": 8.0}
+
+
+class Scenario:
+    """A scripted session: the files it starts with and the turns it replays"""
+
+    def __init__(
+        self,
+        name: str,
+        mode: str,
+        turns: Callable[[float], List[Turn]],
+        setup: Optional[Callable[[str, float], None]] = None,
+        description: str = "",
+    ):
+        self.name = name
+        self.mode = mode
+        self.turns = turns
+        self.setup = setup
+        self.description = description
+
+
+def _scaled(count: int, scale: float) -> int:
+    return max(1, int(count * scale))
+
+
+def _editor_small_turns(scale: float) -> List[Turn]:
+    turns = []
+    for i in range(_scaled(40, scale)):
+        path = f"/repo/notes/file_{i}.txt"
+        turns.append(
+            [
+                {
+                    "command": "create",
+                    "path": path,
+                    "file_text": "".join(f"line {n} of file {i}\n" for n in range(50)),
+                },
+                {
+                    "command": "str_replace",
+                    "path": path,
+                    "old_str": "line 25 of",
+                    "new_str": "edited line 25 of",
+                },
+                {"command": "view", "path": path, "view_range": [20, 30]},
+            ]
+        )
+    turns.append([{"command": "view", "path": "/repo/notes"}])
+    return turns
+
+
+def _large_file_lines(scale: float) -> int:
+    return _scaled(1_500_000, scale)
+
+
+def _setup_large_file(workdir: str, scale: float) -> None:
+    lines = _large_file_lines(scale)
+    with open(os.path.join(workdir, "big.txt"), "w") as f:
+        for start in range(0, lines, 10_000):
+            f.write(
+                "".join(
+                    f"{n:09d} lorem ipsum dolor sit amet, consectetur\n"
+                    for n in range(start, min(start + 10_000, lines))
+                )
+            )
+
+
+def _large_file_turns(scale: float) -> List[Turn]:
+    lines = _large_file_lines(scale)
+    path = "/repo/big.txt"
+    turns: List[Turn] = []
+    for k in range(1, 11):
+        line = lines * k // 11
+        turns.append(
+            [
+                {"command": "view", "path": path, "view_range": [line, line + 40]},
+                {
+                    "command": "str_replace",
+                    "path": path,
+                    "old_str": f"{line:09d} lorem",
+                    "new_str": f"{line:09d} LOREM",
+                },
+            ]
+        )
+    turns.append(
+        [{"command": "insert", "path": path, "insert_line": lines // 2, "new_str": "x"}]
+    )
+    turns.append([{"command": "undo_edit", "path": path}])
+    turns.append([{"command": "view", "path": path}])
+    return turns
+
+
+def _bash_small_turns(scale: float) -> List[Turn]:
+    turns: List[Turn] = [[{"command": "mkdir -p work && cd work && export N=0"}]]
+    for i in range(_scaled(60, scale)):
+        turns.append(
+            [
+                {"command": f"N=$((N + 1)); echo {i} > f{i}.txt; echo $N"},
+                {"command": "pwd && ls | wc -l"},
+            ]
+        )
+    return turns
+
+
+def _bash_large_output_turns(scale: float) -> List[Turn]:
+    lines = _scaled(3_000_000, scale)
+    turns: List[Turn] = []
+    for _ in range(_scaled(8, scale)):
+        turns.append([{"command": f"seq 1 {lines}"}])
+        turns.append([{"command": f"yes 'a longer line of output' | head -n {lines}"}])
+    return turns
+
+
+def _long_session_turns(scale: float) -> List[Turn]:
+    path = "/repo/counter.txt"
+    turns: List[Turn] = [
+        [{"command": "create", "path": path, "file_text": "count: 0\n" + "pad\n" * 200}]
+    ]
+    for i in range(_scaled(300, scale)):
+        turn: Turn = [
+            {
+                "command": "str_replace",
+                "path": path,
+                "old_str": f"count: {i}\n",
+                "new_str": f"count: {i + 1}\n",
+            }
+        ]
+        if i % 10 == 0:
+            turn.append({"command": "view", "path": path})
+        turns.append(turn)
+    return turns
+
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in (
+        Scenario(
+            "editor_small",
+            "editor",
+            _editor_small_turns,
+            description="create/str_replace/view on many small files",
+        ),
+        Scenario(
+            "editor_large_file",
+            "editor",
+            _large_file_turns,
+            setup=_setup_large_file,
+            description="view_range, edits and undo on a ~75 MB file",
+        ),
+        Scenario(
+            "bash_small",
+            "bash",
+            _bash_small_turns,
+            description="many short commands in one persistent shell",
+        ),
+        Scenario(
+            "bash_large_output",
+            "bash",
+            _bash_large_output_turns,
+            description="commands printing tens of MB each",
+        ),
+        Scenario(
+            "long_session",
+            "editor",
+            _long_session_turns,
+            description="hundreds of turns on one file, exercising compaction",
+        ),
+    )
+}
+
+
+def run_worker(mode: str, workdir: str, result_path: str, stream: bool) -> None:
+    """Run one session against ANTHROPIC_BASE_URL and write raw measurements"""
+    from .main import BashSession, EditorSession, SessionLogger
+    from .main import new_session_id
+
+    sessions_dir = os.path.join(workdir, ".sessions")
+    os.makedirs(sessions_dir, exist_ok=True)
+    session_id = new_session_id()
+    session_logger = SessionLogger(session_id, sessions_dir, console=False)
+    if mode == "bash":
+        session = BashSession(session_id=session_id, cwd=workdir)
+    else:
+        session = EditorSession(session_id=session_id, editor_dir=workdir)
+    session.configure(stream=stream)
+    session.set_logger(session_logger)
+
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    try:
+        session.run("benchmark")
+    finally:
+        wall = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+        session.close()
+        session_logger.close()
+
+    metrics = session_logger.metrics.to_dict()
+    result = {
+        "wall_seconds": wall,
+        "cpu_seconds": cpu,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "summary": metrics["summary"],
+        "tool_output_bytes": sum(
+            series["value"]
+            for series in metrics["counters"].get("tool_output_bytes_total", [])
+        ),
+    }
+    with open(result_path, "w") as f:
+        json.dump(result, f)
+
+
+def run_scenario(
+    scenario: Scenario, scale: float, latency: float, stream: bool
+) -> Dict[str, Any]:
+    """Serve a scenario's turns locally and run its session in a fresh process.
+
+    Each scenario gets its own interpreter so peak RSS is not polluted by
+    the ones before it.
+    """
+    workdir = tempfile.mkdtemp(prefix=f"acu-bench-{scenario.name}-")
+    try:
+        if scenario.setup is not None:
+            scenario.setup(workdir, scale)
+        result_path = os.path.join(workdir, ".result.json")
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        with MockMessagesServer(scenario.turns(scale), latency=latency) as server:
+            env = dict(
+                os.environ,
+                ANTHROPIC_BASE_URL=server.base_url,
+                ANTHROPIC_API_KEY="benchmark",
+                PYTHONPATH=os.pathsep.join(
+                    filter(None, [package_root, os.environ.get("PYTHONPATH")])
+                ),
+            )
+            command = [
+                sys.executable,
+                "-m",
+                "anthropic_computer_use.benchmark",
+                "--worker",
+                scenario.mode,
+                "--workdir",
+                workdir,
+                "--result",
+                result_path,
+            ]
+            if stream:
+                command.append("--stream")
+            subprocess.run(
+                command, cwd=workdir, env=env, check=True, stdout=subprocess.DEVNULL
+            )
+            requests, bytes_received = server.requests, server.bytes_received
+        with open(result_path, "r") as f:
+            raw = json.load(f)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = raw["summary"]
+    turns = max(summary["turns"], 1)
+    wall = raw["wall_seconds"]
+    tool_seconds = summary["tool_seconds"]
+    # Time per turn that is neither the simulated model nor tool execution
+    overhead = (wall - tool_seconds - latency * requests) / turns
+    return {
+        "scenario": scenario.name,
+        "mode": scenario.mode,
+        "turns": summary["turns"],
+        "tool_calls": summary["tool_calls"],
+        "wall_seconds": round(wall, 4),
+        "cpu_seconds": round(raw["cpu_seconds"], 4),
+        "turns_per_second": round(summary["turns"] / wall, 2) if wall else None,
+        "overhead_per_turn_ms": round(overhead * 1000, 3),
+        "tool_seconds": round(tool_seconds, 4),
+        "tool_calls_per_second": (
+            round(summary["tool_calls"] / tool_seconds, 1) if tool_seconds else None
+        ),
+        "tool_output_mb_per_second": (
+            round(raw["tool_output_bytes"] / tool_seconds / 1e6, 2)
+            if tool_seconds
+            else None
+        ),
+        "request_mb": round(bytes_received / 1e6, 3),
+        "peak_rss_mb": round(raw["peak_rss_kb"] / 1024, 1),
+    }
+
+
+def compare(
+    results: List[Dict[str, Any]],
+    baseline: List[Dict[str, Any]],
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> List[str]:
+    """Describe every metric that got worse than baseline by more than tolerance"""
+    previous = {result["scenario"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result["scenario"])
+        if before is None:
+            continue
+        for metric, slack in _SLACK.items():
+            old, new = before.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            if new > old * (1 + tolerance) and new - old > slack:
+                regressions.append(
+                    f"{result['scenario']}: {metric} {old} -> {new} "
+                    f"(+{(new - old) / old * 100 if old else float('inf'):.0f}%)"
+                )
+    return regressions
+
+
+def format_table(results: List[Dict[str, Any]]) -> str:
+    columns = [
+        ("scenario", "scenario"),
+        ("turns", "turns"),
+        ("turns/s", "turns_per_second"),
+        ("overhead ms/turn", "overhead_per_turn_ms"),
+        ("tool calls/s", "tool_calls_per_second"),
+        ("tool MB/s", "tool_output_mb_per_second"),
+        ("peak RSS MB", "peak_rss_mb"),
+        ("wall s", "wall_seconds"),
+    ]
+    rows = [[header for header, _ in columns]]
+    rows.extend([str(result.get(key)) for _, key in columns] for result in results)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths))
+        for row in rows
+    )
+
+
+def main():
+    """Benchmark the agent loop offline against a local mock Messages API"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        help="Scenarios to run (default: all, see --list).",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Multiply turn counts and data sizes, e.g. 0.1 for a quick CI run.",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=DEFAULT_LATENCY,
+        help="Artificial model latency per API call, in seconds.",
+    )
+    parser.add_argument("--stream", action="store_true", help="Use streaming calls.")
+    parser.add_argument("--json", metavar="FILE", help="Write the results here.")
+    parser.add_argument(
+        "--baseline",
+        metavar="FILE",
+        help="Results of an earlier run; exit non-zero on regressions.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Allowed relative slowdown against the baseline.",
+    )
+    parser.add_argument("--list", action="store_true", help="List the scenarios.")
+    # Internal: run one session inside the benchmark's child process
+    parser.add_argument("--worker", choices=["editor", "bash"], help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.workdir, args.result, args.stream)
+        return
+
+    if args.list:
+        for scenario in SCENARIOS.values():
+            print(f"{scenario.name:20} {scenario.mode:7} {scenario.description}")
+        return
+
+    names = args.scenarios or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+    results = []
+    for name in names:
+        print(f"Running {name}...", file=sys.stderr)
+        scenario = SCENARIOS[name]
+        results.append(run_scenario(scenario, args.scale, args.latency, args.stream))
+    print(format_table(results))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import json
+import os
+import socket
+import sys
+
+# Only the standard library is imported at module level, so a command
+# forwarded to a running daemon starts without loading the SDK. Without a
+# daemon (or with ACU_NO_DAEMON set) the command runs in this process.
+
+PROG = "main"
+# Seconds `daemon start` waits for the new daemon to accept connections
+START_TIMEOUT = 30.0
+
+
+def socket_path() -> str:
+    """$ACU_SOCKET, else a per-user socket in $XDG_RUNTIME_DIR or /tmp"""
+    path = os.environ.get("ACU_SOCKET")
+    if path:
+        return path
+    directory = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(directory, f"anthropic-computer-use-{os.getuid()}.sock")
+
+
+def _connect(path: str) -> socket.socket:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def _request(path: str, request: dict) -> dict:
+    """Send a control request and return the daemon's single reply"""
+    with _connect(path) as sock, sock.makefile("rb") as reply:
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        return json.loads(reply.readline())
+
+
+def forward(argv: list, path: str):
+    """Run a command in the daemon; return its exit code, or None if none is running"""
+    try:
+        sock = _connect(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+    request = {"command": "run", "argv": argv, "cwd": os.getcwd(), "prog": PROG}
+    with sock, sock.makefile("rb") as frames:
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        for line in frames:
+            frame = json.loads(line)
+            if "exit" in frame:
+                return frame["exit"]
+            if "error" in frame:
+                print(f"daemon: {frame['error']}", file=sys.stderr)
+                return 1
+            stream = sys.stdout if frame["stream"] == "stdout" else sys.stderr
+            stream.write(frame["data"])
+            stream.flush()
+    print("daemon: connection closed before the command finished", file=sys.stderr)
+    return 1
+
+
+def start_daemon(path: str, extra_args: list) -> int:
+    import subprocess
+    import time
+
+    try:
+        pid = _request(path, {"command": "ping"})["pid"]
+        print(f"Daemon already running (pid {pid})")
+        return 0
+    except (FileNotFoundError, ConnectionRefusedError):
+        pass
+
+    env = os.environ.copy()
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in (package_root, env.get("PYTHONPATH")) if p
+    )
+    log_path = os.path.splitext(path)[0] + ".log"
+    with open(log_path, "ab") as log:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "anthropic_computer_use.daemon", "--socket", path]
+            + extra_args,
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            env=env,
+            start_new_session=True,
+        )
+
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            print(f"Daemon exited during startup, see {log_path}", file=sys.stderr)
+            return 1
+        try:
+            _request(path, {"command": "ping"})
+        except (FileNotFoundError, ConnectionRefusedError):
+            time.sleep(0.05)
+            continue
+        print(f"Daemon started (pid {process.pid}) on {path}")
+        return 0
+    print(f"Daemon did not come up within {START_TIMEOUT:.0f}s", file=sys.stderr)
+    return 1
+
+
+def daemon_command(args: list) -> int:
+    """`daemon start|stop|status|run` subcommands"""
+    action = args[0] if args else "status"
+    path = socket_path()
+    if action == "start":
+        return start_daemon(path, args[1:])
+    if action == "run":
+        from .daemon import serve
+
+        try:
+            serve(path)
+        except KeyboardInterrupt:
+            pass
+        return 0
+    if action not in ("stop", "status"):
+        print(f"usage: {PROG} daemon [start|stop|status|run]", file=sys.stderr)
+        return 2
+    try:
+        reply = _request(path, {"command": "shutdown" if action == "stop" else "ping"})
+    except (FileNotFoundError, ConnectionRefusedError):
+        print("Daemon not running")
+        return 0 if action == "stop" else 1
+    if action == "stop":
+        print("Daemon stopping")
+    else:
+        print(f"Daemon running (pid {reply['pid']}, {reply['sessions']} idle sessions)")
+    return 0
+
+
+def main():
+    argv = sys.argv[1:]
+    if argv and argv[0] == "daemon":
+        sys.exit(daemon_command(argv[1:]))
+    if not os.environ.get("ACU_NO_DAEMON"):
+        code = forward(argv, socket_path())
+        if code is not None:
+            sys.exit(code)
+
+    from .main import main as run_main
+
+    run_main(argv, prog=PROG)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import threading
+import weakref
+from typing import Any, Dict, Optional, Tuple
+
+import anthropic
+import httpx
+
+from .rate_limit import RateLimitScheduler
+
+# Agent turns are often tens of seconds apart (model latency plus tool
+# time), longer than httpx's default 5 s keep-alive; keep idle connections
+# open so consecutive turns reuse the TLS session instead of reconnecting
+CONNECTION_LIMITS = httpx.Limits(
+    max_connections=100, max_keepalive_connections=32, keepalive_expiry=120.0
+)
+REQUEST_TIMEOUT = httpx.Timeout(timeout=600.0, connect=10.0)
+
+_clients: Dict[Tuple[Optional[str], Optional[str]], anthropic.Anthropic] = {}
+_clients_lock = threading.Lock()
+_scheduler: Optional[RateLimitScheduler] = None
+# httpx's async pool belongs to the event loop it is used on
+_async_clients: "weakref.WeakKeyDictionary[Any, anthropic.AsyncAnthropic]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def shared_client() -> anthropic.Anthropic:
+    """Process-wide Anthropic client for the current API key and base URL.
+
+    Sessions share it so that its connection pool, and the TLS connections
+    in it, outlive any single session. SDK retries are off: the scheduler
+    retries with backoff shared across sessions.
+    """
+    key = (os.environ.get("ANTHROPIC_API_KEY"), os.environ.get("ANTHROPIC_BASE_URL"))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = anthropic.Anthropic(
+                api_key=key[0],
+                max_retries=0,
+                timeout=REQUEST_TIMEOUT,
+                http_client=anthropic.DefaultHttpxClient(
+                    limits=CONNECTION_LIMITS, timeout=REQUEST_TIMEOUT
+                ),
+            )
+        return client
+
+
+def shared_async_client() -> anthropic.AsyncAnthropic:
+    """AsyncAnthropic shared by every session on the running event loop.
+
+    Same pool settings as shared_client(). Whoever runs the loop closes it
+    with close_async_client() once its sessions are done.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = anthropic.AsyncAnthropic(
+            api_key=os.environ.get("ANTHROPIC_API_KEY"),
+            max_retries=0,
+            timeout=REQUEST_TIMEOUT,
+            http_client=anthropic.DefaultAsyncHttpxClient(
+                limits=CONNECTION_LIMITS, timeout=REQUEST_TIMEOUT
+            ),
+        )
+    return client
+
+
+async def close_async_client() -> None:
+    """Close the running event loop's shared AsyncAnthropic, if it has one"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+
+def shared_scheduler() -> RateLimitScheduler:
+    """Process-wide rate-limit scheduler shared by all sessions"""
+    global _scheduler
+    with _clients_lock:
+        if _scheduler is None:
+            _scheduler = RateLimitScheduler()
+        return _scheduler
@@ -0,0 +1,139 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+ELIDED_PREFIX = "[elided"
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def _block_text(block: Dict[str, Any]) -> str:
+    if block.get("type") == "text":
+        return block.get("text", "")
+    if block.get("type") == "tool_use":
+        return json.dumps(block.get("input", {}))
+    if block.get("type") == "tool_result":
+        content = block.get("content", "")
+        if isinstance(content, str):
+            return content
+        return "".join(_block_text(part) for part in content)
+    return ""
+
+
+def estimate_message_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Estimate the token count of a conversation"""
+    total = 0
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+        else:
+            total += sum(estimate_tokens(_block_text(block)) for block in content)
+    return total
+
+
+def _describe(tool_use: Optional[Dict[str, Any]]) -> str:
+    if not tool_use:
+        return "an earlier tool call"
+    tool_input = tool_use.get("input", {})
+    if "path" in tool_input:
+        return f"`{tool_input.get('command', tool_use.get('name'))} {tool_input['path']}`"
+    if "command" in tool_input:
+        return f"`{str(tool_input['command'])[:80]}`"
+    return f"`{tool_use.get('name')}`"
+
+
+class ContextCompactor:
+    """Keeps a conversation under a token budget by eliding stale tool output.
+
+    Only the text inside old tool_result blocks is replaced, so every
+    tool_use keeps its matching tool_result. Results whose file was touched
+    again later are dropped first, then the oldest remaining results. The
+    most recent `keep_recent` tool turns are never touched. Compaction stops
+    at `target_ratio` of the budget so it does not run (and invalidate the
+    prompt cache) on every turn.
+    """
+
+    def __init__(
+        self,
+        budget_tokens: int = 100_000,
+        keep_recent: int = 2,
+        target_ratio: float = 0.75,
+        min_chars: int = 400,
+    ):
+        self.budget_tokens = budget_tokens
+        self.keep_recent = keep_recent
+        self.target_ratio = target_ratio
+        self.min_chars = min_chars
+        self.tokens_reclaimed = 0
+
+    def _candidates(
+        self, messages: List[Dict[str, Any]]
+    ) -> List[Tuple[bool, int, Dict[str, Any], Optional[Dict[str, Any]]]]:
+        """Collect elidable tool_result blocks as (fresh, position, block, tool_use)"""
+        tool_uses: Dict[str, Dict[str, Any]] = {}
+        last_touch: Dict[str, int] = {}
+        result_turns: List[int] = []
+
+        for index, message in enumerate(messages):
+            content = message.get("content")
+            if not isinstance(content, list):
+                continue
+            for block in content:
+                if block.get("type") == "tool_use":
+                    tool_uses[block["id"]] = block
+                    path = block.get("input", {}).get("path")
+                    if path:
+                        last_touch[path] = index
+                elif block.get("type") == "tool_result":
+                    if not result_turns or result_turns[-1] != index:
+                        result_turns.append(index)
+
+        protected = set(result_turns[-self.keep_recent :]) if self.keep_recent else set()
+        candidates = []
+        position = 0
+        for index in result_turns:
+            if index in protected:
+                continue
+            for block in messages[index]["content"]:
+                if block.get("type") != "tool_result":
+                    continue
+                text = _block_text(block)
+                if len(text) < self.min_chars or text.startswith(ELIDED_PREFIX):
+                    continue
+                tool_use = tool_uses.get(block.get("tool_use_id"))
+                path = (tool_use or {}).get("input", {}).get("path")
+                # The tool_use sits in the assistant turn right before this one
+                superseded = bool(path) and last_touch.get(path, -1) > index - 1
+                candidates.append((not superseded, position, block, tool_use))
+                position += 1
+
+        candidates.sort(key=lambda candidate: candidate[:2])
+        return candidates
+
+    def compact(self, messages: List[Dict[str, Any]]) -> int:
+        """Elide stale tool output in place; return the tokens reclaimed"""
+        total = estimate_message_tokens(messages)
+        if total <= self.budget_tokens:
+            return 0
+
+        target = int(self.budget_tokens * self.target_ratio)
+        reclaimed = 0
+        for fresh, _, block, tool_use in self._candidates(messages):
+            if total - reclaimed <= target:
+                break
+            text = _block_text(block)
+            lines = text.count("\n") + 1
+            reason = "old output" if fresh else "superseded by a later call"
+            summary = (
+                f"{ELIDED_PREFIX} {len(text)} chars / {lines} lines of "
+                f"output from {_describe(tool_use)} to save context ({reason}); "
+                f"repeat the call if you need it again]"
+            )
+            block["content"] = [{"type": "text", "text": summary}]
+            reclaimed += estimate_tokens(text) - estimate_tokens(summary)
+
+        self.tokens_reclaimed += reclaimed
+        return reclaimed
@@ -0,0 +1,307 @@
+import argparse
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Dict, IO, Optional, Tuple
+
+from .clients import shared_client
+from .main import AgentSession, main as run_main
+from .response_cache import ResponseCache
+from .session_store import SessionStore
+
+# Sessions kept alive between commands are closed after this long unused
+DEFAULT_IDLE_SECONDS = 15 * 60
+REAP_INTERVAL_SECONDS = 30
+
+
+class ResidentState:
+    """Long-lived objects the daemon shares between client commands.
+
+    Session stores and response caches are opened once per path. Sessions
+    are checked in after a command and handed back out when a later command
+    resumes them, so a bash session keeps its shell (cwd, variables) and an
+    editor session its file caches. A checked-out session belongs to one
+    command at a time.
+    """
+
+    def __init__(self, idle_seconds: float = DEFAULT_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._sessions: Dict[str, Tuple[AgentSession, float]] = {}
+        self._stores: Dict[str, SessionStore] = {}
+        self._caches: Dict[Tuple[str, str], ResponseCache] = {}
+        self._lock = threading.Lock()
+
+    def store(self, path: str) -> SessionStore:
+        with self._lock:
+            store = self._stores.get(path)
+            if store is None:
+                store = self._stores[path] = SessionStore(path)
+            return store
+
+    def response_cache(self, directory: str, mode: str, max_bytes: int) -> ResponseCache:
+        with self._lock:
+            cache = self._caches.get((directory, mode))
+            if cache is None:
+                cache = self._caches[(directory, mode)] = ResponseCache(
+                    directory, mode=mode, max_bytes=max_bytes
+                )
+            cache.max_bytes = max_bytes
+            return cache
+
+    def checkout(self, session_id: str) -> Optional[AgentSession]:
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+        return entry[0] if entry is not None else None
+
+    def checkin(self, session: AgentSession) -> None:
+        with self._lock:
+            previous = self._sessions.pop(session.session_id, None)
+            self._sessions[session.session_id] = (session, time.monotonic())
+        if previous is not None and previous[0] is not session:
+            previous[0].close()
+
+    @property
+    def session_count(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def reap_idle(self) -> int:
+        """Close sessions unused for idle_seconds; return how many"""
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            idle = [
+                session_id
+                for session_id, (_, last_used) in self._sessions.items()
+                if last_used < cutoff
+            ]
+            sessions = [self._sessions.pop(session_id)[0] for session_id in idle]
+        for session in sessions:
+            session.close()
+        return len(sessions)
+
+    def close_all(self) -> None:
+        with self._lock:
+            sessions = [session for session, _ in self._sessions.values()]
+            stores = list(self._stores.values())
+            self._sessions.clear()
+            self._stores.clear()
+            self._caches.clear()
+        for session in sessions:
+            session.close()
+        for store in stores:
+            store.close()
+
+
+class ThreadRoutedStream(io.TextIOBase):
+    """Stand-in for sys.stdout/sys.stderr that writes to a per-thread target.
+
+    Each command runs on its own handler thread, which routes its prints to
+    the client that sent it; other threads write to the daemon's stream.
+    """
+
+    def __init__(self, default: IO[str]):
+        self._default = default
+        self._local = threading.local()
+
+    def route(self, stream: Optional[IO[str]]) -> None:
+        self._local.stream = stream
+
+    def _target(self) -> IO[str]:
+        return getattr(self._local, "stream", None) or self._default
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: str) -> int:
+        return self._target().write(data)
+
+    def flush(self) -> None:
+        self._target().flush()
+
+
+class ClientStream(io.TextIOBase):
+    """Forwards writes to the client as JSON-line frames tagged with a stream name.
+
+    A client that went away is ignored; the command runs to completion and
+    its conversation is still stored.
+    """
+
+    def __init__(self, wfile: IO[bytes], name: str, lock: threading.Lock):
+        self._wfile = wfile
+        self._name = name
+        self._lock = lock
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: str) -> int:
+        if data:
+            send_frame(self._wfile, self._lock, {"stream": self._name, "data": data})
+        return len(data)
+
+
+def send_frame(wfile: IO[bytes], lock: threading.Lock, frame: Dict[str, Any]) -> None:
+    payload = json.dumps(frame).encode() + b"\n"
+    with lock:
+        try:
+            wfile.write(payload)
+            wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, ValueError):
+            pass
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    """One client connection: a single JSON request line, then frames back"""
+
+    server: "DaemonServer"
+
+    def handle(self) -> None:
+        lock = threading.Lock()
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            send_frame(self.wfile, lock, {"error": "malformed request"})
+            return
+
+        command = request.get("command")
+        if command == "ping":
+            send_frame(
+                self.wfile,
+                lock,
+                {"pid": os.getpid(), "sessions": self.server.state.session_count},
+            )
+        elif command == "shutdown":
+            send_frame(self.wfile, lock, {"ok": True})
+            self.server.request_shutdown()
+        elif command == "run":
+            code = self.server.run(
+                request,
+                ClientStream(self.wfile, "stdout", lock),
+                ClientStream(self.wfile, "stderr", lock),
+            )
+            send_frame(self.wfile, lock, {"exit": code})
+        else:
+            send_frame(self.wfile, lock, {"error": f"unknown command {command!r}"})
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, state: ResidentState):
+        self.path = path
+        self.state = state
+        self.stdout = ThreadRoutedStream(sys.stdout)
+        self.stderr = ThreadRoutedStream(sys.stderr)
+        _remove_stale_socket(path)
+        # Only the owner may connect: commands run with the daemon's credentials
+        umask = os.umask(0o177)
+        try:
+            super().__init__(path, CommandHandler)
+        finally:
+            os.umask(umask)
+
+    def run(self, request: Dict[str, Any], stdout: IO[str], stderr: IO[str]) -> int:
+        """Run main() for a client command and return its exit code"""
+        self.stdout.route(stdout)
+        self.stderr.route(stderr)
+        try:
+            run_main(
+                request.get("argv") or [],
+                cwd=request.get("cwd"),
+                console_stream=stderr,
+                resident=self.state,
+                prog=request.get("prog"),
+            )
+            return 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            print(e.code, file=stderr)
+            return 1
+        except Exception:
+            stderr.write(traceback.format_exc())
+            return 1
+        finally:
+            self.stdout.route(None)
+            self.stderr.route(None)
+
+    def request_shutdown(self) -> None:
+        # shutdown() waits for serve_forever, so it cannot run on its thread
+        threading.Thread(target=self.shutdown, daemon=True).start()
+
+    def serve(self) -> None:
+        """Serve until shut down, then close every resident session"""
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+        stop = threading.Event()
+        reaper = threading.Thread(target=self._reap, args=(stop,), daemon=True)
+        reaper.start()
+        try:
+            self.serve_forever()
+        finally:
+            stop.set()
+            sys.stdout, sys.stderr = self.stdout._default, self.stderr._default
+            self.server_close()
+            self.state.close_all()
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    def _reap(self, stop: threading.Event) -> None:
+        while not stop.wait(REAP_INTERVAL_SECONDS):
+            self.state.reap_idle()
+
+
+def _remove_stale_socket(path: str) -> None:
+    """Delete a socket left behind by a daemon that is no longer running"""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f"A daemon is already listening on {path}")
+
+
+def serve(path: str, idle_seconds: float = DEFAULT_IDLE_SECONDS) -> None:
+    """Warm up, then serve client commands on a Unix socket until stopped"""
+    # Build the HTTP client (and its connection pool) before the first command
+    shared_client()
+    server = DaemonServer(path, ResidentState(idle_seconds))
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.request_shutdown())
+    print(f"Listening on {path} (pid {os.getpid()})", flush=True)
+    server.serve()
+
+
+def main():
+    """Run the resident daemon in the foreground"""
+    from .cli import socket_path
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--socket", default=None, help="Unix socket to listen on")
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=DEFAULT_IDLE_SECONDS,
+        help="Close sessions unused for this many seconds.",
+    )
+    args = parser.parse_args()
+    try:
+        serve(args.socket or socket_path(), args.idle_timeout)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
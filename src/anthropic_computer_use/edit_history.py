@@ -0,0 +1,188 @@
+import hashlib
+import os
+import threading
+from collections import deque
+from typing import Deque, Dict, List
+
+from .stream_edit import splice
+
+DEFAULT_HISTORY_BYTES = 16 * 1024 * 1024
+
+# Rough per-delta bookkeeping cost counted against the byte cap
+_DELTA_OVERHEAD = 128
+
+
+class EditHistoryError(Exception):
+    """Raised when an edit cannot be undone"""
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _common_length(a: bytes, b: bytes, limit: int, from_end: bool) -> int:
+    """Length of the common prefix (or suffix) of a and b, up to `limit`.
+
+    Binary search over slice comparisons keeps the work in C instead of a
+    per-byte Python loop.
+    """
+    a_view, b_view = memoryview(a), memoryview(b)
+    low, high = 0, limit
+    while low < high:
+        mid = (low + high + 1) // 2
+        if from_end:
+            same = a_view[len(a) - mid :] == b_view[len(b) - mid :]
+        else:
+            same = a_view[:mid] == b_view[:mid]
+        if same:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+class ReverseDelta:
+    """What is needed to turn a file back into its state before one edit.
+
+    After the edit, `new_length` bytes at `offset` replaced `original`. The
+    digest of those new bytes and the file size are kept so an undo can
+    verify the file has not been changed by something else since.
+    """
+
+    __slots__ = (
+        "path",
+        "offset",
+        "new_length",
+        "new_digest",
+        "original",
+        "size",
+        "created",
+    )
+
+    def __init__(
+        self,
+        path: str,
+        offset: int,
+        original: bytes,
+        new_region: bytes,
+        size: int,
+        created: bool = False,
+    ):
+        self.path = path
+        self.offset = offset
+        self.original = original
+        self.new_length = len(new_region)
+        self.new_digest = _digest(new_region)
+        self.size = size
+        self.created = created
+
+    @property
+    def cost(self) -> int:
+        return len(self.original) + _DELTA_OVERHEAD
+
+
+class EditHistory:
+    """Per-session undo stacks of reverse deltas, bounded in total bytes.
+
+    Deltas only hold the bytes an edit replaced, so undoing a one-line
+    change to a huge file costs a small patch. When the cap is exceeded
+    the oldest deltas, across all files, are evicted first.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_HISTORY_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._stacks: Dict[str, List[ReverseDelta]] = {}
+        self._order: Deque[ReverseDelta] = deque()
+        self._lock = threading.Lock()
+
+    def _push(self, delta: ReverseDelta) -> None:
+        with self._lock:
+            if delta.cost > self.max_bytes:
+                # Too large to keep; older deltas no longer line up either
+                self._forget(delta.path)
+                return
+            self._stacks.setdefault(delta.path, []).append(delta)
+            self._order.append(delta)
+            self.total_bytes += delta.cost
+            while self.total_bytes > self.max_bytes:
+                oldest = self._order.popleft()
+                self.total_bytes -= oldest.cost
+                stack = self._stacks.get(oldest.path)
+                if stack:
+                    stack.remove(oldest)
+                    if not stack:
+                        del self._stacks[oldest.path]
+
+    def _forget(self, path: str) -> None:
+        for delta in self._stacks.pop(path, []):
+            self.total_bytes -= delta.cost
+        self._order = deque(d for d in self._order if d.path != path)
+
+    def forget(self, path: str) -> None:
+        """Drop the history of a file after a change that cannot be undone"""
+        with self._lock:
+            self._forget(path)
+
+    def record_splice(
+        self, path: str, offset: int, original: bytes, new_region: bytes
+    ) -> None:
+        """Record an edit that replaced `original` with `new_region` at `offset`"""
+        self._push(
+            ReverseDelta(path, offset, original, new_region, os.path.getsize(path))
+        )
+
+    def record_change(self, path: str, old: bytes, new: bytes) -> None:
+        """Record a whole-content change, keeping only the differing middle"""
+        limit = min(len(old), len(new))
+        prefix = _common_length(old, new, limit, from_end=False)
+        suffix = _common_length(old, new, limit - prefix, from_end=True)
+        self.record_splice(
+            path,
+            prefix,
+            old[prefix : len(old) - suffix],
+            new[prefix : len(new) - suffix],
+        )
+
+    def record_created(self, path: str, content: bytes) -> None:
+        """Record the creation of a file that did not exist before"""
+        with self._lock:
+            self._forget(path)
+        self._push(ReverseDelta(path, 0, b"", content, len(content), created=True))
+
+    def can_undo(self, path: str) -> bool:
+        return bool(self._stacks.get(path))
+
+    def undo(self, path: str) -> ReverseDelta:
+        """Revert the latest recorded edit of `path` and return its delta"""
+        with self._lock:
+            stack = self._stacks.get(path)
+            if not stack:
+                raise EditHistoryError(f"No edit history found for {path}")
+            delta = stack[-1]
+
+            try:
+                size = os.path.getsize(path)
+                with open(path, "rb") as f:
+                    f.seek(delta.offset)
+                    current = f.read(delta.new_length)
+            except FileNotFoundError:
+                raise EditHistoryError(f"File {path} no longer exists")
+            if size != delta.size or _digest(current) != delta.new_digest:
+                self._forget(path)
+                raise EditHistoryError(
+                    f"File {path} was modified outside the editor since the last "
+                    "edit; its edit history was discarded"
+                )
+
+            if delta.created:
+                os.remove(path)
+            else:
+                splice(path, delta.offset, delta.new_length, delta.original)
+
+            stack.pop()
+            if not stack:
+                del self._stacks[path]
+            self._order.remove(delta)
+            self.total_bytes -= delta.cost
+            return delta
@@ -0,0 +1,138 @@
+import os
+import stat
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+StatKey = Tuple[int, int, int]
+
+
+def _read_umask() -> int:
+    """The process umask, without changing it where /proc shows it"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError):
+        pass
+    # Only at import time, before any tool worker threads create files
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+_UMASK = _read_umask()
+
+
+def stat_key(st: os.stat_result) -> StatKey:
+    """Identity of a file version: (mtime_ns, size, inode)"""
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def atomic_write(path: str, text: str) -> os.stat_result:
+    """Write a file through a temp file in the same directory and rename it.
+
+    A crash mid-write leaves the previous contents intact. The existing
+    file's permission bits are preserved, and a symlink is written through
+    rather than replaced. Returns the new file's stat.
+    """
+    path = os.path.realpath(path)
+    directory = os.path.dirname(path)
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return os.stat(path)
+
+
+class DocumentCache:
+    """Per-session cache of file contents.
+
+    Entries are validated against (mtime_ns, size, inode) on every read, so
+    changes made outside the editor (e.g. from bash) are picked up. Least
+    recently used entries are evicted once the cached total exceeds
+    `max_bytes`; files larger than that are never cached.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[StatKey, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _store(self, path: str, key: StatKey, text: str) -> None:
+        self._discard(path)
+        size = key[1]
+        if size > self.max_bytes:
+            return
+        self._entries[path] = (key, text)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, (old_key, _) = self._entries.popitem(last=False)
+            self.total_bytes -= old_key[1]
+
+    def _discard(self, path: str) -> None:
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.total_bytes -= entry[0][1]
+
+    def read(self, path: str) -> str:
+        """Return the file's text, from cache when the file is unchanged"""
+        key = stat_key(os.stat(path))
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        with open(path, "r") as f:
+            text = f.read()
+        # Only cache if the file did not change while it was being read
+        if stat_key(os.stat(path)) == key:
+            with self._lock:
+                self._store(path, key, text)
+        return text
+
+    def write(self, path: str, text: str) -> None:
+        """Atomically write the file and cache what was written"""
+        st = atomic_write(path, text)
+        with self._lock:
+            if "\r" in text:
+                # Reading back would translate newlines; let the next read fill it
+                self._discard(path)
+            else:
+                self._store(path, stat_key(st), text)
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        """Drop one path, or everything when no path is given"""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self.total_bytes = 0
+            else:
+                self._discard(path)
@@ -0,0 +1,205 @@
+import bisect
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+from array import array
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from .file_cache import StatKey, stat_key
+
+INDEX_SUFFIX = ".lineidx"
+_MAGIC = b"ACULIDX1"
+_HEADER = struct.Struct("<8sQQQQ")
+_NEWLINE = re.compile(b"\n")
+_BUILD_CHUNK = 4 * 1024 * 1024
+# Loaded indexes kept per session; each holds an mmap (and its descriptor)
+DEFAULT_MAX_INDEXES = 32
+
+
+def index_path(path: str) -> str:
+    """Sidecar index file kept next to the indexed file"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}{INDEX_SUFFIX}")
+
+
+class LineIndex:
+    """Byte offsets of every line start in a file, backed by an mmap'd sidecar.
+
+    The sidecar stores the file's (mtime_ns, size, inode) in its header and
+    is rebuilt when they no longer match, so any change to the file
+    invalidates it. Slicing lines then only touches the requested bytes.
+    """
+
+    def __init__(self, path: str, key: StatKey, offsets: memoryview, keepalive=None):
+        self.path = path
+        self.key = key
+        self._offsets = offsets
+        self._keepalive = keepalive
+
+    @property
+    def line_count(self) -> int:
+        return len(self._offsets)
+
+    @classmethod
+    def load(cls, path: str, key: StatKey) -> Optional["LineIndex"]:
+        """Map an existing sidecar if it matches the file's current version"""
+        try:
+            with open(index_path(path), "rb") as f:
+                if os.fstat(f.fileno()).st_size < _HEADER.size:
+                    return None
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            return None
+        magic, mtime_ns, size, inode, count = _HEADER.unpack_from(mapped)
+        if magic != _MAGIC or (mtime_ns, size, inode) != key:
+            mapped.close()
+            return None
+        if len(mapped) != _HEADER.size + count * 8:
+            mapped.close()
+            return None
+        offsets = memoryview(mapped)[_HEADER.size :].cast("Q")
+        return cls(path, key, offsets, keepalive=mapped)
+
+    @classmethod
+    def build(cls, path: str, key: StatKey, persist: bool = True) -> "LineIndex":
+        """Scan the file for newlines in chunks and optionally persist the index"""
+        offsets = array("Q")
+        size = key[1]
+        if size:
+            offsets.append(0)
+        with open(path, "rb") as f:
+            position = 0
+            while True:
+                chunk = f.read(_BUILD_CHUNK)
+                if not chunk:
+                    break
+                offsets.extend(
+                    position + match.end() for match in _NEWLINE.finditer(chunk)
+                )
+                position += len(chunk)
+        # A trailing newline does not start another line
+        if offsets and offsets[-1] == size:
+            offsets.pop()
+
+        if persist:
+            cls._persist(path, key, offsets)
+        return cls(path, key, memoryview(offsets))
+
+    @staticmethod
+    def _persist(path: str, key: StatKey, offsets: array) -> None:
+        target = index_path(path)
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(target) or ".", suffix=".tmp"
+            )
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, *key, len(offsets)))
+                offsets.tofile(f)
+            os.replace(tmp_path, target)
+        except OSError:
+            # The index is only an accelerator; an unwritable directory is fine
+            pass
+
+    def read_lines(self, start: int, end: int) -> List[str]:
+        """Return lines `start`..`end` (1-indexed, inclusive) without newlines"""
+        start = max(start, 1)
+        end = min(end, self.line_count)
+        if start > end:
+            return []
+        begin = self._offsets[start - 1]
+        stop = self._offsets[end] if end < self.line_count else self.key[1]
+        with open(self.path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                data = mapped[begin:stop]
+        return split_lines(data.decode(errors="replace"))
+
+    def line_bytes(self, line: int) -> int:
+        """Length of a line in bytes, including its newline"""
+        begin = self._offsets[line - 1]
+        stop = self._offsets[line] if line < self.line_count else self.key[1]
+        return stop - begin
+
+    def read_line_head(self, line: int, max_bytes: int) -> str:
+        """The first `max_bytes` of a line, read without loading the rest"""
+        with open(self.path, "rb") as f:
+            f.seek(self._offsets[line - 1])
+            data = f.read(min(max_bytes, self.line_bytes(line)))
+        return data.rstrip(b"\n").decode(errors="replace")
+
+    def max_end(self, start: int, max_bytes: int) -> int:
+        """Last line number starting within `max_bytes` of line `start`"""
+        if start > self.line_count:
+            return self.line_count
+        limit = self._offsets[start - 1] + max_bytes
+        return max(bisect.bisect_right(self._offsets, limit), start)
+
+
+class LineIndexCache:
+    """In-process map of loaded line indexes, revalidated on every lookup.
+
+    At most `max_indexes` are kept; the least recently used is dropped
+    first, which unmaps its sidecar once no reader still holds it.
+    """
+
+    def __init__(self, persist: bool = True, max_indexes: int = DEFAULT_MAX_INDEXES):
+        self.persist = persist
+        self.max_indexes = max_indexes
+        self._indexes: "OrderedDict[str, LineIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> LineIndex:
+        key = stat_key(os.stat(path))
+        with self._lock:
+            index = self._indexes.get(path)
+            if index is not None and index.key == key:
+                self._indexes.move_to_end(path)
+                return index
+            index = LineIndex.load(path, key) or LineIndex.build(
+                path, key, persist=self.persist
+            )
+            self._indexes[path] = index
+            self._indexes.move_to_end(path)
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+            return index
+
+
+def split_lines(text: str) -> List[str]:
+    """Split on newlines only; a trailing newline does not add an empty line"""
+    if not text:
+        return []
+    lines = text.split("\n")
+    if text.endswith("\n"):
+        lines.pop()
+    return lines
+
+
+def number_lines(lines: List[str], first_line: int = 1) -> str:
+    """Render lines the way `cat -n` does"""
+    return "\n".join(
+        f"{number:6}\t{line}" for number, line in enumerate(lines, first_line)
+    )
+
+
+def parse_view_range(
+    view_range: Optional[List[int]], line_count: int
+) -> Tuple[int, int]:
+    """Validate a [start, end] view_range (end == -1 means end of file)"""
+    if not view_range:
+        return 1, line_count
+    if len(view_range) != 2 or not all(isinstance(n, int) for n in view_range):
+        raise ValueError("view_range must be a list of two integers")
+    start, end = view_range
+    if end == -1:
+        end = line_count
+    if start < 1 or start > max(line_count, 1):
+        raise ValueError(
+            f"view_range start {start} is outside the file's lines [1, {line_count}]"
+        )
+    if end < start:
+        raise ValueError(f"view_range end {end} is before start {start}")
+    return start, min(end, line_count)
@@ -1,19 +1,74 @@
 import os
 import anthropic
+from anthropic.types.beta import BetaMessage
 import argparse
-import yaml
-import subprocess
 from datetime import datetime
 import uuid
-from typing import Dict, Any, List, Optional, Union
+from typing import IO, Callable, Dict, Any, List, Optional, Tuple, Union
 import traceback
 import sys
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import time
+
+from .sandbox import ResourceLimits
+from .session_store import SessionNotFound, SessionStore, repair_conversation
+from .shell import (
+    DEFAULT_MAX_OUTPUT_BYTES,
+    DEFAULT_TIMEOUT,
+    ShellExited,
+    ShellProcess,
+)
+from .clients import shared_client, shared_scheduler
+from .compaction import ContextCompactor
+from .edit_history import EditHistory, EditHistoryError
+from .file_cache import DocumentCache
+from .line_index import (
+    LineIndexCache,
+    number_lines,
+    parse_view_range,
+    split_lines,
+)
+from .metrics import SessionMetrics
+from .rate_limit import Reservation
+from .prompt_cache import (
+    PROMPT_CACHING_BETA_FLAG,
+    cached_system,
+    with_message_breakpoints,
+)
+from .result_shaping import DEFAULT_RESULT_TOKENS, shape_output, shape_view
+from .response_cache import (
+    DEFAULT_CACHE_BYTES,
+    MODES as RESPONSE_CACHE_MODES,
+    ResponseCache,
+    request_key,
+)
+from .stream_edit import find_occurrences, line_start_offset, splice
+from .streaming import StreamAccumulator
+from .structured_logging import (
+    DEFAULT_PAYLOAD_CHARS,
+    SessionLogAdapter,
+    setup_session_logging,
+    shutdown_session_logging,
+)
+from .tool_executor import ToolBatch, ToolExecutor
+from .tree_index import TreeIndex
 
 EDITOR_DIR = os.path.join(os.getcwd(), "editor_dir")
+SESSION_MODES = ("editor", "bash", "combined")
+
+# Files above this size are viewed through an on-disk line index and
+# edited by streaming them through a temp file instead of in memory
+LINE_INDEX_THRESHOLD_BYTES = 1024 * 1024
+STREAM_EDIT_THRESHOLD_BYTES = LINE_INDEX_THRESHOLD_BYTES
+# Upper bound on the text a single view returns
+MAX_VIEW_BYTES = 256 * 1024
+# Lines shown when an oversized file is viewed without a view_range
+VIEW_PREVIEW_LINES = 200
+# Depth and size limits of a directory view
+DIRECTORY_VIEW_DEPTH = 2
+DIRECTORY_VIEW_ENTRIES = 400
 SESSIONS_DIR = os.path.join(os.getcwd(), "sessions")
-os.makedirs(SESSIONS_DIR, exist_ok=True)
 
 
 # Fetch system prompts from environment variables or use defaults
@@ -24,49 +79,129 @@ EDITOR_SYSTEM_PROMPT = os.environ.get(
     "EDITOR_SYSTEM_PROMPT",
     "You are a helpful assistant that helps users edit text files.",
 )
+COMBINED_SYSTEM_PROMPT = os.environ.get(
+    "COMBINED_SYSTEM_PROMPT",
+    "You are a helpful assistant that can edit text files and execute bash commands.",
+)
+
+
+def new_session_id() -> str:
+    """Create a session ID shared by the logger and the session"""
+    return datetime.now().strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+
+def format_tool_result(tool_use_id: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a handler result to the tool_result format expected by the API"""
+    is_error = False
+
+    if result.get("error"):
+        is_error = True
+        tool_result_content = [{"type": "text", "text": result["error"]}]
+    else:
+        tool_result_content = [{"type": "text", "text": result.get("content", "")}]
+
+    return {
+        "tool_call_id": tool_use_id,
+        "output": {
+            "type": "tool_result",
+            "content": tool_result_content,
+            "tool_use_id": tool_use_id,
+            "is_error": is_error,
+        },
+    }
 
 
 class SessionLogger:
-    def __init__(self, session_id: str, sessions_dir: str):
+    def __init__(
+        self,
+        session_id: str,
+        sessions_dir: str,
+        max_payload_chars: int = DEFAULT_PAYLOAD_CHARS,
+        sample_rate: float = 1.0,
+        prometheus_dir: Optional[str] = None,
+        console: bool = True,
+        console_stream: Optional[IO[str]] = None,
+    ):
         self.session_id = session_id
         self.sessions_dir = sessions_dir
+        self.max_payload_chars = max_payload_chars
+        self.sample_rate = sample_rate
+        self.prometheus_dir = prometheus_dir
+        self.console = console
+        self.console_stream = console_stream
         self.logger = self._setup_logging()
 
+        # Latency histograms and tool throughput counters
+        self.metrics = SessionMetrics(session_id)
+
         # Initialize token counters
         self.total_input_tokens = 0
         self.total_output_tokens = 0
+        self.total_cache_creation_tokens = 0
+        self.total_cache_read_tokens = 0
+        self.tokens_reclaimed = 0
 
     def _setup_logging(self) -> logging.Logger:
-        """Configure logging for the session"""
-        log_formatter = logging.Formatter(
-            "%(asctime)s - %(name)s - %(levelname)s - %(prefix)s - %(message)s"
-        )
-        log_file = os.path.join(self.sessions_dir, f"{self.session_id}.log")
-
-        file_handler = RotatingFileHandler(
-            log_file, maxBytes=1024 * 1024, backupCount=5
+        """Configure queue-backed JSONL logging for the session"""
+        os.makedirs(self.sessions_dir, exist_ok=True)
+        log_file = os.path.join(self.sessions_dir, f"{self.session_id}.jsonl")
+        return setup_session_logging(
+            self.session_id,
+            log_file,
+            max_payload_chars=self.max_payload_chars,
+            sample_rate=self.sample_rate,
+            console=self.console,
+            console_stream=self.console_stream,
         )
-        file_handler.setFormatter(log_formatter)
 
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(log_formatter)
+    def adapter(self, prefix: str) -> SessionLogAdapter:
+        """Logger for one session component, tagged with its prefix"""
+        return SessionLogAdapter(self.logger, {"prefix": prefix})
 
-        logger = logging.getLogger(self.session_id)
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
-        logger.setLevel(logging.DEBUG)
-
-        return logger
+    def write_metrics(self):
+        """Write the metrics JSON, and the Prometheus textfile if configured."""
+        self.metrics.write_json(
+            os.path.join(self.sessions_dir, f"{self.session_id}.metrics.json")
+        )
+        if self.prometheus_dir:
+            os.makedirs(self.prometheus_dir, exist_ok=True)
+            self.metrics.write_prometheus(
+                os.path.join(self.prometheus_dir, f"{self.session_id}.prom")
+            )
+        self.adapter("📊 session").event(
+            "session_metrics", "Session metrics", **self.metrics.to_dict()["summary"]
+        )
 
-    def update_token_usage(self, input_tokens: int, output_tokens: int):
+    def close(self):
+        """Write the session metrics, then flush and stop the logging thread."""
+        try:
+            self.write_metrics()
+        finally:
+            shutdown_session_logging(self.session_id)
+
+    def update_token_usage(
+        self,
+        input_tokens: int,
+        output_tokens: int,
+        cache_creation_tokens: int = 0,
+        cache_read_tokens: int = 0,
+    ):
         """Update the total token usage."""
         self.total_input_tokens += input_tokens
         self.total_output_tokens += output_tokens
+        self.total_cache_creation_tokens += cache_creation_tokens
+        self.total_cache_read_tokens += cache_read_tokens
+
+    def update_tokens_reclaimed(self, tokens: int):
+        """Record tokens removed from the conversation by compaction."""
+        self.tokens_reclaimed += tokens
 
     def log_total_cost(self):
         """Calculate and log the total cost based on token usage."""
         cost_per_million_input_tokens = 3.0  # $3.00 per million input tokens
         cost_per_million_output_tokens = 15.0  # $15.00 per million output tokens
+        cost_per_million_cache_write_tokens = 3.75  # $3.75 per million cache writes
+        cost_per_million_cache_read_tokens = 0.30  # $0.30 per million cache reads
 
         total_input_cost = (
             self.total_input_tokens / 1_000_000
@@ -74,36 +209,494 @@ class SessionLogger:
         total_output_cost = (
             self.total_output_tokens / 1_000_000
         ) * cost_per_million_output_tokens
-        total_cost = total_input_cost + total_output_cost
+        total_cache_write_cost = (
+            self.total_cache_creation_tokens / 1_000_000
+        ) * cost_per_million_cache_write_tokens
+        total_cache_read_cost = (
+            self.total_cache_read_tokens / 1_000_000
+        ) * cost_per_million_cache_read_tokens
+        total_cost = (
+            total_input_cost
+            + total_output_cost
+            + total_cache_write_cost
+            + total_cache_read_cost
+        )
+
+        self.adapter("📊 session").event(
+            "session_summary",
+            f"Total cost: ${total_cost:.6f}",
+            input_tokens=self.total_input_tokens,
+            output_tokens=self.total_output_tokens,
+            cache_creation_tokens=self.total_cache_creation_tokens,
+            cache_read_tokens=self.total_cache_read_tokens,
+            tokens_reclaimed=self.tokens_reclaimed,
+            input_cost=round(total_input_cost, 6),
+            output_cost=round(total_output_cost, 6),
+            cache_write_cost=round(total_cache_write_cost, 6),
+            cache_read_cost=round(total_cache_read_cost, 6),
+            total_cost=round(total_cost, 6),
+        )
+
+
+class AgentSession:
+    """Agent loop shared by the editor and bash sessions.
+
+    Subclasses provide `tools`, `system_prompt` and `_submit_tool_call`.
+    """
+
+    model = "claude-3-5-sonnet-20241022"
+    max_tokens = 4096
+    betas = ["computer-use-2024-10-22"]
+    tools: List[Dict[str, Any]] = []
+    system_prompt = ""
+    prompt_caching = True
+    stream = False
+    context_budget = 100_000
+    result_token_budget = DEFAULT_RESULT_TOKENS
+    response_cache: Optional[ResponseCache] = None
+    session_store: Optional[SessionStore] = None
+    mode = ""
+    _compactor: Optional[ContextCompactor] = None
+
+    def configure(self, **settings: Any) -> None:
+        """Override class-level settings (stream, session_store, ...) for this session"""
+        for name, value in settings.items():
+            if not hasattr(AgentSession, name):
+                raise AttributeError(f"Unknown session setting {name!r}")
+            setattr(self, name, value)
+        if "context_budget" in settings:
+            self._compactor = None
+
+    def _compact(self) -> None:
+        """Elide stale tool output once the conversation exceeds its budget"""
+        if self._compactor is None:
+            self._compactor = ContextCompactor(budget_tokens=self.context_budget)
+        reclaimed = self._compactor.compact(self.messages)
+        if reclaimed:
+            self.logger.event(
+                "compaction",
+                f"Compacted conversation, reclaimed ~{reclaimed} tokens",
+                tokens_reclaimed=reclaimed,
+            )
+            self.session_logger.update_tokens_reclaimed(reclaimed)
+
+    def _message_params(self) -> Dict[str, Any]:
+        """Build the keyword arguments for a messages.create call
+
+        With prompt caching on, the tools+system prefix and the latest turns
+        carry cache breakpoints so each iteration only pays full price for
+        what was added since the previous one.
+        """
+        self._compact()
+        system, tools, messages = self.system_prompt, self.tools, self.messages
+        betas = self.betas
+        if self.prompt_caching:
+            system, tools = cached_system(system, tools)
+            messages = with_message_breakpoints(messages)
+            betas = betas + [PROMPT_CACHING_BETA_FLAG]
+        return {
+            "model": self.model,
+            "max_tokens": self.max_tokens,
+            "messages": messages,
+            "tools": tools,
+            "system": system,
+            "betas": betas,
+        }
+
+    def _append_message(self, message: Dict[str, Any]) -> None:
+        """Add a message to the conversation and persist it"""
+        self.messages.append(message)
+        if self.session_store is not None:
+            self.session_store.append_message(
+                self.session_id, len(self.messages) - 1, message
+            )
+
+    def _set_status(self, status: str) -> None:
+        if self.session_store is not None:
+            self.session_store.set_status(self.session_id, status)
+
+    def _start_conversation(self, prompt: str) -> None:
+        """Reset the conversation to a single user message"""
+        if self.session_store is not None:
+            self.session_store.create_session(self.session_id, self.mode, prompt)
+        # Initial message with proper content structure
+        api_message = {
+            "role": "user",
+            "content": [{"type": "text", "text": prompt}],
+        }
+        self.messages = []
+        self._append_message(api_message)
+
+        self.logger.event("user_input", "User input", prompt=prompt)
+
+    def _resume_conversation(self, prompt: Optional[str] = None) -> bool:
+        """Reload the stored conversation, optionally adding a new prompt
+
+        Tools are not re-run: calls interrupted mid-turn get error results.
+        Returns False when the conversation already ended and there is no
+        new prompt, i.e. there is nothing to send.
+        """
+        if self.session_store is None:
+            raise ValueError("Resuming a session requires the session store")
+        stored = self.session_store.load_messages(self.session_id)
+        self.messages = list(stored)
+        for message in repair_conversation(stored)[len(stored) :]:
+            self._append_message(message)
+
+        if prompt:
+            text = {"type": "text", "text": prompt}
+            if self.messages and self.messages[-1]["role"] == "user":
+                # Consecutive user turns are merged into one message
+                last = self.messages.pop()
+                content = last["content"] + [text]
+                self._append_message({"role": "user", "content": content})
+            else:
+                self._append_message({"role": "user", "content": [text]})
+            self.logger.event("user_input", "User input", prompt=prompt)
+
+        self.logger.event(
+            "session_resumed", "Resumed stored session", messages=len(self.messages)
+        )
+        return bool(self.messages) and self.messages[-1]["role"] == "user"
+
+    def _replay_response(
+        self, params: Dict[str, Any]
+    ) -> Tuple[Optional[str], Optional[BetaMessage]]:
+        """Look a request up in the response cache
+
+        Returns (cache key, recorded response); the key is None when the
+        cache is off and the response is None when the API must be called.
+        """
+        if self.response_cache is None or not self.response_cache.enabled:
+            return None, None
+        key = request_key(params)
+        data = self.response_cache.lookup(key)
+        if data is None:
+            return key, None
+        self.session_logger.metrics.increment("response_cache_hits_total")
+        self.logger.event("api_replay", "Replayed recorded API response", key=key)
+        return key, BetaMessage.model_validate(data)
+
+    def _store_response(self, key: Optional[str], response: Any) -> None:
+        if key is not None:
+            self.response_cache.store(key, response.model_dump(mode="json"))
+
+    def _record_response(self, response: Any, replayed: bool = False) -> None:
+        """Account for token usage and append the assistant turn
+
+        Replayed responses cost nothing, so their usage is not counted.
+        """
+        # Extract token usage from the response
+        input_tokens = getattr(response.usage, "input_tokens", 0)
+        output_tokens = getattr(response.usage, "output_tokens", 0)
+        cache_creation_tokens = (
+            getattr(response.usage, "cache_creation_input_tokens", 0) or 0
+        )
+        cache_read_tokens = getattr(response.usage, "cache_read_input_tokens", 0) or 0
+        self.logger.event(
+            "api_usage",
+            "API usage",
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            cache_creation_input_tokens=cache_creation_tokens,
+            cache_read_input_tokens=cache_read_tokens,
+            replayed=replayed,
+        )
 
-        prefix = "📊 session"
-        self.logger.info(
-            f"Total input tokens: {self.total_input_tokens}", extra={"prefix": prefix}
+        # Update token counts in SessionLogger
+        if not replayed:
+            self.session_logger.update_token_usage(
+                input_tokens, output_tokens, cache_creation_tokens, cache_read_tokens
+            )
+        self.session_logger.metrics.increment("turns_total")
+
+        # The response model is only dumped by the logging thread
+        self.logger.event(
+            "api_response",
+            "API response",
+            level=logging.DEBUG,
+            response=response,
         )
-        self.logger.info(
-            f"Total output tokens: {self.total_output_tokens}", extra={"prefix": prefix}
+
+        # Convert response content to message params
+        response_content = []
+        for block in response.content:
+            if block.type == "text":
+                response_content.append({"type": "text", "text": block.text})
+            else:
+                response_content.append(block.model_dump())
+
+        # Add assistant response to messages
+        self._append_message({"role": "assistant", "content": response_content})
+
+    def _record_tool_results(self, tool_results: List[Dict[str, Any]]) -> bool:
+        """Append tool results to the conversation, return True to stop on error"""
+        if not tool_results:
+            return False
+
+        # Add every tool result to a single user message
+        self._append_message(
+            {
+                "role": "user",
+                "content": [result["output"] for result in tool_results],
+            }
         )
-        self.logger.info(
-            f"Total input cost: ${total_input_cost:.6f}", extra={"prefix": prefix}
+
+        errors = [
+            result["output"]["content"]
+            for result in tool_results
+            if result["output"]["is_error"]
+        ]
+        for error in errors:
+            self.logger.event(
+                "tool_error", "Tool error", level=logging.ERROR, content=error
+            )
+        return bool(errors)
+
+    @staticmethod
+    def _response_text(response: Any) -> str:
+        """Join the text blocks of a final response"""
+        return "".join(block.text for block in response.content if block.type == "text")
+
+    def _last_assistant_text(self) -> str:
+        for message in reversed(self.messages):
+            if message["role"] == "assistant":
+                return "".join(
+                    block.get("text", "")
+                    for block in message["content"]
+                    if block.get("type") == "text"
+                )
+        return ""
+
+    def _submit_tool_call(
+        self, batch: ToolBatch, tool_call: anthropic.types.ContentBlock
+    ) -> None:
+        raise NotImplementedError
+
+    def _record_api_call(
+        self,
+        started: float,
+        response: Any,
+        first_token: Optional[float] = None,
+        reservation: Optional[Reservation] = None,
+    ) -> None:
+        """Record the latency and output throughput of one API call
+
+        Time spent queued for rate limits or backing off is recorded apart
+        from the API latency.
+        """
+        queued = reservation.queued if reservation is not None else 0.0
+        retries = reservation.retries if reservation is not None else 0
+        if queued or retries:
+            self.logger.event(
+                "rate_limit",
+                f"Waited {queued:.2f}s for rate limits ({retries} retries)",
+                queued_seconds=round(queued, 3),
+                retries=retries,
+            )
+        self.session_logger.metrics.record_api_call(
+            time.perf_counter() - started - queued,
+            getattr(response.usage, "output_tokens", 0) or 0,
+            first_token - queued if first_token is not None else None,
+            queued=queued,
+            retries=retries,
         )
-        self.logger.info(
-            f"Total output cost: ${total_output_cost:.6f}", extra={"prefix": prefix}
+
+    def _timed_tool_call(
+        self,
+        tool_call: anthropic.types.ContentBlock,
+        command: str,
+        handler: Callable[[Dict[str, Any]], Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """Run a tool handler and record its duration and payload sizes"""
+        started = time.perf_counter()
+        result = handler(tool_call.input)
+        duration = time.perf_counter() - started
+        result = self._shape_result(tool_call, result)
+        formatted = format_tool_result(tool_call.id, result)
+        output = formatted["output"]
+        self.session_logger.metrics.record_tool_call(
+            tool_call.name,
+            command,
+            duration,
+            bytes_in=len(json.dumps(tool_call.input).encode()),
+            bytes_out=sum(len(block["text"].encode()) for block in output["content"]),
+            is_error=output["is_error"],
         )
-        self.logger.info(f"Total cost: ${total_cost:.6f}", extra={"prefix": prefix})
+        return formatted
+
+    def _shape_result(
+        self, tool_call: anthropic.types.ContentBlock, result: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Clean up a tool result and fit it to result_token_budget
+
+        Command output loses escape codes, redraws and repeated lines and is
+        cut in the middle; file views are only cut. Both say how to fetch
+        what was left out.
+        """
+        if tool_call.name == "bash":
+            shape = shape_output
+        elif tool_call.input.get("command") == "view":
+            shape = shape_view
+        else:
+            return result
+        shaped = dict(result)
+        saved = 0
+        for field in ("content", "error"):
+            if isinstance(result.get(field), str):
+                shaped[field], tokens = shape(result[field], self.result_token_budget)
+                saved += tokens
+        if saved:
+            self.logger.event(
+                "result_shaped",
+                f"Trimmed ~{saved} tokens from {tool_call.name} result",
+                tool_use_id=tool_call.id,
+                tokens_saved=saved,
+            )
+            self.session_logger.metrics.increment(
+                "tool_result_tokens_trimmed_total", saved, tool=tool_call.name
+            )
+        return shaped
+
+    def process_tool_calls(
+        self, tool_calls: List[anthropic.types.ContentBlock]
+    ) -> List[Dict[str, Any]]:
+        """Process tool calls and return results"""
+        batch = self.tool_executor.batch()
 
+        for tool_call in tool_calls:
+            self._submit_tool_call(batch, tool_call)
 
-class EditorSession:
-    def __init__(self, session_id: Optional[str] = None):
+        return batch.results()
+
+    @staticmethod
+    def _emit_text(text: str) -> None:
+        """Print streamed assistant text as it arrives"""
+        print(text, end="", flush=True)
+
+    def _stream_response(self, batch: ToolBatch, params: Dict[str, Any]) -> Any:
+        """Stream a response, dispatching each tool_use block once it is complete"""
+        accumulator = StreamAccumulator(
+            on_text=self._emit_text,
+            on_tool_use=lambda tool_call: self._submit_tool_call(batch, tool_call),
+        )
+        started = time.perf_counter()
+        first_token = None
+        events, reservation = self.scheduler.create(self.client, params, stream=True)
+        try:
+            for event in events:
+                if first_token is None and event.type == "content_block_delta":
+                    first_token = time.perf_counter() - started
+                accumulator.feed(event)
+            response = accumulator.message()
+        except BaseException:
+            self.scheduler.settle(reservation)
+            raise
+        self.scheduler.settle(reservation, response.usage)
+        self._record_api_call(started, response, first_token, reservation)
+        return response
+
+    def run(self, prompt: str) -> str:
+        """Run the agent loop for a prompt and return the final assistant text
+
+        In streaming mode text is printed as it arrives and tools start while
+        the model is still generating the rest of the response.
+        """
+        self._start_conversation(prompt)
+        return self._run_loop()
+
+    def resume(self, prompt: Optional[str] = None) -> str:
+        """Continue a stored session, optionally with a new prompt"""
+        if not self._resume_conversation(prompt):
+            self.logger.info("Stored session already finished, nothing to resume")
+            return self._last_assistant_text()
+        return self._run_loop()
+
+    def _run_loop(self) -> str:
+        """Call the model and run its tools until it stops asking for them"""
+        try:
+            final_text, status = self._run_turns()
+        except KeyboardInterrupt:
+            self._set_status("interrupted")
+            raise
+        except Exception:
+            self._set_status("failed")
+            raise
+        self._set_status(status)
+
+        # After the execution loop, log the total cost
+        self.session_logger.log_total_cost()
+        return final_text
+
+    def _run_turns(self) -> Tuple[str, str]:
+        """Return the final text and whether the session completed or stopped"""
+        while True:
+            params = self._message_params()
+            key, response = self._replay_response(params)
+            replayed = response is not None
+            streamed = self.stream and not replayed
+            if replayed:
+                if self.stream:
+                    self._emit_text(self._response_text(response) + "\n")
+            elif streamed:
+                batch = self.tool_executor.batch()
+                response = self._stream_response(batch, params)
+                tool_results = batch.results()
+                self._emit_text("\n")
+            else:
+                started = time.perf_counter()
+                response, reservation = self.scheduler.create(self.client, params)
+                self.scheduler.settle(reservation, response.usage)
+                self._record_api_call(started, response, reservation=reservation)
+            if not replayed:
+                self._store_response(key, response)
+            self._record_response(response, replayed)
+
+            if response.stop_reason != "tool_use":
+                return self._response_text(response), "completed"
+
+            if not streamed:
+                tool_results = self.process_tool_calls(response.content)
+            if self._record_tool_results(tool_results):
+                return "", "stopped"
+
+
+class EditorSession(AgentSession):
+    mode = "editor"
+    tools = [{"type": "text_editor_20241022", "name": "str_replace_editor"}]
+    system_prompt = EDITOR_SYSTEM_PROMPT
+
+    def __init__(
+        self,
+        session_id: Optional[str] = None,
+        editor_dir: Optional[str] = None,
+        sessions_dir: Optional[str] = None,
+    ):
         """Initialize editor session with optional existing session ID"""
         self.session_id = session_id or self._create_session_id()
-        self.sessions_dir = SESSIONS_DIR
-        self.editor_dir = EDITOR_DIR
-        self.client = anthropic.Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
+        self.sessions_dir = sessions_dir or SESSIONS_DIR
+        self.editor_dir = editor_dir or EDITOR_DIR
+        self.client = shared_client()
+        self.scheduler = shared_scheduler()
         self.messages = []
 
         # Create editor directory if needed
         os.makedirs(self.editor_dir, exist_ok=True)
 
+        # Worker threads for running independent tool calls concurrently
+        self.tool_executor = ToolExecutor()
+
+        # File contents and resolved paths, reused across tool calls
+        self.documents = DocumentCache()
+        self.line_indexes = LineIndexCache()
+        self._editor_paths: Dict[str, str] = {}
+
+        # Reverse deltas backing undo_edit
+        self.history = EditHistory()
+
+        # Cached directory listings for directory views
+        self.tree = TreeIndex(self.editor_dir)
+
         # Initialize logger placeholder
         self.logger = None
 
@@ -113,9 +706,7 @@ class EditorSession:
     def set_logger(self, session_logger: SessionLogger):
         """Set the logger for the session and store the SessionLogger instance."""
         self.session_logger = session_logger
-        self.logger = logging.LoggerAdapter(
-            self.session_logger.logger, {"prefix": self.log_prefix}
-        )
+        self.logger = session_logger.adapter(self.log_prefix)
 
     def _create_session_id(self) -> str:
         """Create a new session ID"""
@@ -124,59 +715,227 @@ class EditorSession:
 
     def _get_editor_path(self, path: str) -> str:
         """Convert API path to local editor directory path"""
-        # Strip any leading /repo/ from the path
-        clean_path = path.replace("/repo/", "", 1)
-        # Join with editor_dir
-        full_path = os.path.join(self.editor_dir, clean_path)
-        # Create the directory structure if it doesn't exist
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        full_path = self._editor_paths.get(path)
+        if full_path is None:
+            # Strip any leading /repo/ from the path
+            clean_path = path.replace("/repo/", "", 1)
+            # Join with editor_dir
+            full_path = os.path.join(self.editor_dir, clean_path)
+            self._editor_paths[path] = full_path
         return full_path
 
-    def _handle_view(self, path: str, _: Dict[str, Any]) -> Dict[str, Any]:
-        """Handle view command"""
-        editor_path = self._get_editor_path(path)
-        if os.path.exists(editor_path):
-            with open(editor_path, "r") as f:
-                return {"content": f.read()}
-        return {"error": f"File {editor_path} does not exist"}
+    def _handle_view(self, path: str, tool_call: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle view command
+
+        Returns numbered lines, optionally limited to `view_range`. Large
+        files are sliced through a line index instead of being read whole,
+        and a full view of an oversized file degrades to a preview.
+        """
+        if not os.path.exists(path):
+            return {"error": f"File {path} does not exist"}
+        if os.path.isdir(path):
+            return self._handle_view_directory(path)
+
+        size = os.path.getsize(path)
+        if size <= LINE_INDEX_THRESHOLD_BYTES:
+            lines = split_lines(self.documents.read(path))
+            line_count = len(lines)
+            max_end = None
+
+            def read_lines(start: int, end: int) -> List[str]:
+                return lines[start - 1 : end]
+
+            def line_length(line: int) -> int:
+                return len(lines[line - 1].encode())
+
+            def read_line_head(line: int, max_bytes: int) -> str:
+                head = lines[line - 1].encode()[:max_bytes]
+                return head.decode(errors="replace")
+
+        else:
+            index = self.line_indexes.get(path)
+            line_count = index.line_count
+            read_lines = index.read_lines
+            max_end = index.max_end
+            line_length = index.line_bytes
+            read_line_head = index.read_line_head
+
+        view_range = tool_call.get("view_range")
+        try:
+            start, end = parse_view_range(view_range, line_count)
+        except ValueError as e:
+            return {"error": str(e)}
+
+        requested_end = end
+        if not view_range and size > MAX_VIEW_BYTES:
+            end = min(end, VIEW_PREVIEW_LINES)
+        if max_end is not None:
+            end = min(end, max_end(start, MAX_VIEW_BYTES))
+
+        selected = []
+        long_line = None
+        if start <= line_count and line_length(start) + 8 > MAX_VIEW_BYTES:
+            # A single line over the budget (minified JSON, a data dump) is
+            # cut instead of being read and returned whole
+            long_line = line_length(start)
+            selected.append(read_line_head(start, MAX_VIEW_BYTES))
+        else:
+            budget = MAX_VIEW_BYTES
+            for line in read_lines(start, end):
+                budget -= len(line) + 8
+                if budget < 0:
+                    break
+                selected.append(line)
+        end = start + len(selected) - 1
+
+        content = f"Here's the result of running `cat -n` on {path}:\n"
+        content += number_lines(selected, start) + "\n"
+        if long_line is not None:
+            content += (
+                f"\n[Line {start} is {long_line} bytes long; showing its first "
+                f"{MAX_VIEW_BYTES} bytes.]\n"
+            )
+        if end < requested_end:
+            content += (
+                f"\n[Showing lines {start}-{end} of {line_count} ({size} bytes). "
+                f"Use view_range to see other lines.]\n"
+            )
+        return {"content": content}
+
+    def _handle_view_directory(self, path: str) -> Dict[str, Any]:
+        """List a directory from the tree index, depth- and size-limited"""
+        entries, omitted = self.tree.listing(
+            path, max_depth=DIRECTORY_VIEW_DEPTH, max_entries=DIRECTORY_VIEW_ENTRIES
+        )
+        content = (
+            f"Here's the files and directories up to {DIRECTORY_VIEW_DEPTH} levels "
+            f"deep in {path}, excluding hidden and ignored items:\n"
+        )
+        content += "\n".join(entries) + "\n"
+        if omitted:
+            content += (
+                f"\n[{omitted} more entries not shown. "
+                f"View a subdirectory to see more.]\n"
+            )
+        return {"content": content}
+
+    @staticmethod
+    def _read_bytes(path: str) -> bytes:
+        """Read a file's raw bytes (used to diff small files for undo)"""
+        with open(path, "rb") as f:
+            return f.read()
 
     def _handle_create(self, path: str, tool_call: Dict[str, Any]) -> Dict[str, Any]:
         """Handle create command"""
         os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "w") as f:
-            f.write(tool_call["file_text"])
+        old = None
+        existed = os.path.exists(path)
+        if existed and os.path.getsize(path) <= self.history.max_bytes:
+            old = self._read_bytes(path)
+
+        self.documents.write(path, tool_call["file_text"])
+
+        new = tool_call["file_text"].encode()
+        if not existed:
+            self.history.record_created(path, new)
+        elif old is not None:
+            self.history.record_change(path, old, new)
+        else:
+            self.history.forget(path)
         return {"content": f"File created at {path}"}
 
     def _handle_str_replace(
         self, path: str, tool_call: Dict[str, Any]
     ) -> Dict[str, Any]:
-        """Handle str_replace command"""
-        with open(path, "r") as f:
-            content = f.read()
-        if tool_call["old_str"] not in content:
+        """Handle str_replace command
+
+        old_str must occur exactly once. Large files are scanned in a single
+        streaming pass that stops at the second match, then rewritten through
+        a chunked copy, so memory use does not depend on file size.
+        """
+        old_str = tool_call["old_str"]
+        new_str = tool_call.get("new_str") or ""
+        if not old_str:
+            return {"error": "old_str must not be empty"}
+
+        streaming = os.path.getsize(path) > STREAM_EDIT_THRESHOLD_BYTES
+        if streaming:
+            count, first = find_occurrences(path, old_str.encode())
+        else:
+            content = self.documents.read(path)
+            first = content.find(old_str)
+            if first < 0:
+                count = 0
+            elif content.find(old_str, first + len(old_str)) >= 0:
+                count = 2
+            else:
+                count = 1
+
+        if count == 0:
             return {"error": "old_str not found in file"}
-        new_content = content.replace(
-            tool_call["old_str"], tool_call.get("new_str", "")
-        )
-        with open(path, "w") as f:
-            f.write(new_content)
+        if count > 1:
+            return {
+                "error": "old_str occurs more than once in the file; "
+                "include more surrounding context to make it unique"
+            }
+
+        if streaming:
+            splice(path, first, len(old_str.encode()), new_str.encode())
+            self.documents.invalidate(path)
+            self.history.record_splice(path, first, old_str.encode(), new_str.encode())
+        else:
+            old = self._read_bytes(path)
+            new_content = content[:first] + new_str + content[first + len(old_str) :]
+            self.documents.write(path, new_content)
+            self.history.record_change(path, old, new_content.encode())
         return {"content": "File updated successfully"}
 
     def _handle_insert(self, path: str, tool_call: Dict[str, Any]) -> Dict[str, Any]:
-        """Handle insert command"""
-        with open(path, "r") as f:
-            lines = f.readlines()
+        """Handle insert command
+
+        new_str is inserted after line `insert_line` (0 inserts at the top).
+        """
         insert_line = tool_call["insert_line"]
-        if insert_line > len(lines):
-            return {"error": "insert_line beyond file length"}
-        lines.insert(insert_line, tool_call["new_str"] + "\n")
-        with open(path, "w") as f:
-            f.writelines(lines)
+
+        if os.path.getsize(path) > STREAM_EDIT_THRESHOLD_BYTES:
+            offset, needs_newline = line_start_offset(path, insert_line)
+            if offset is None:
+                return {"error": "insert_line beyond file length"}
+            new_str = tool_call["new_str"] + "\n"
+            if needs_newline:
+                new_str = "\n" + new_str
+            splice(path, offset, 0, new_str.encode())
+            self.documents.invalidate(path)
+            self.history.record_splice(path, offset, b"", new_str.encode())
+        else:
+            content = self.documents.read(path)
+            lines = split_lines(content)
+            if insert_line > len(lines):
+                return {"error": "insert_line beyond file length"}
+            lines.insert(insert_line, tool_call["new_str"])
+            new_content = "\n".join(lines)
+            if content.endswith("\n") or insert_line == len(lines) - 1:
+                new_content += "\n"
+            old = self._read_bytes(path)
+            self.documents.write(path, new_content)
+            self.history.record_change(path, old, new_content.encode())
         return {"content": "Content inserted successfully"}
 
+    def _handle_undo_edit(self, path: str, _: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle undo_edit command"""
+        try:
+            delta = self.history.undo(path)
+        except EditHistoryError as e:
+            return {"error": str(e)}
+        finally:
+            self.documents.invalidate(path)
+        if delta.created:
+            return {"content": f"Undid the creation of {path}"}
+        return {"content": f"Last edit to {path} undone successfully"}
+
     def log_to_session(self, data: Dict[str, Any], section: str) -> None:
         """Log data to session log file"""
-        self.logger.info(f"{section}: {data}")
+        self.logger.event(section, section, data=data)
 
     def handle_text_editor_tool(self, tool_call: Dict[str, Any]) -> Dict[str, Any]:
         """Handle text editor tool calls"""
@@ -185,7 +944,7 @@ class EditorSession:
             if not all(key in tool_call for key in ["command", "path"]):
                 return {"error": "Missing required fields"}
 
-            # Get path and ensure directory exists
+            # Resolve the path inside the editor directory
             path = self._get_editor_path(tool_call["path"])
 
             handlers = {
@@ -193,6 +952,7 @@ class EditorSession:
                 "create": self._handle_create,
                 "str_replace": self._handle_str_replace,
                 "insert": self._handle_insert,
+                "undo_edit": self._handle_undo_edit,
             }
 
             handler = handlers.get(command)
@@ -205,117 +965,52 @@ class EditorSession:
             self.logger.error(f"Error in handle_text_editor_tool: {str(e)}")
             return {"error": str(e)}
 
-    def process_tool_calls(
-        self, tool_calls: List[anthropic.types.ContentBlock]
-    ) -> List[Dict[str, Any]]:
-        """Process tool calls and return results"""
-        results = []
-
-        for tool_call in tool_calls:
-            if tool_call.type == "tool_use" and tool_call.name == "str_replace_editor":
+    def _submit_tool_call(
+        self, batch: ToolBatch, tool_call: anthropic.types.ContentBlock
+    ) -> None:
+        """Schedule an editor tool call
+
+        Calls on different files run concurrently; calls on the same file
+        keep their order, with consecutive views allowed to overlap. Paths
+        are resolved first, so `a.txt`, `./a.txt` and a symlink to it are
+        the same file.
+        """
+        if tool_call.type == "tool_use" and tool_call.name == "str_replace_editor":
+            self.logger.event(
+                "tool_call",
+                f"Editor tool call: {tool_call.input.get('command')}",
+                tool_use_id=tool_call.id,
+                input=tool_call.input,
+            )
 
-                # Log the keys and first 20 characters of the values of the tool_call
-                for key, value in tool_call.input.items():
-                    truncated_value = str(value)[:20] + (
-                        "..." if len(str(value)) > 20 else ""
-                    )
-                    self.logger.info(
-                        f"Tool call key: {key}, Value (truncated): {truncated_value}"
-                    )
+            batch.submit(
+                self._run_tool_call,
+                tool_call,
+                key=os.path.realpath(
+                    self._get_editor_path(tool_call.input.get("path", ""))
+                ),
+                readonly=tool_call.input.get("command") == "view",
+            )
 
-                result = self.handle_text_editor_tool(tool_call.input)
-                # Convert result to match expected tool result format
-                is_error = False
-
-                if result.get("error"):
-                    is_error = True
-                    tool_result_content = [{"type": "text", "text": result["error"]}]
-                else:
-                    tool_result_content = [
-                        {"type": "text", "text": result.get("content", "")}
-                    ]
-
-                results.append(
-                    {
-                        "tool_call_id": tool_call.id,
-                        "output": {
-                            "type": "tool_result",
-                            "content": tool_result_content,
-                            "tool_use_id": tool_call.id,
-                            "is_error": is_error,
-                        },
-                    }
-                )
+    def _run_tool_call(self, tool_call: anthropic.types.ContentBlock) -> Dict[str, Any]:
+        """Run a single editor tool call and format its result"""
+        command = str(tool_call.input.get("command", "unknown"))
+        return self._timed_tool_call(tool_call, command, self.handle_text_editor_tool)
 
-        return results
+    def close(self) -> None:
+        """Release the tool worker threads"""
+        self.tool_executor.shutdown()
 
-    def process_edit(self, edit_prompt: str) -> None:
+    def process_edit(self, edit_prompt: Optional[str], resume: bool = False) -> str:
         """Main method to process editing prompts"""
         try:
-            # Initial message with proper content structure
-            api_message = {
-                "role": "user",
-                "content": [{"type": "text", "text": edit_prompt}],
-            }
-            self.messages = [api_message]
-
-            self.logger.info(f"User input: {api_message}")
-
-            while True:
-                response = self.client.beta.messages.create(
-                    model="claude-3-5-sonnet-20241022",
-                    max_tokens=4096,
-                    messages=self.messages,
-                    tools=[
-                        {"type": "text_editor_20241022", "name": "str_replace_editor"}
-                    ],
-                    system=EDITOR_SYSTEM_PROMPT,
-                    betas=["computer-use-2024-10-22"],
-                )
-
-                # Extract token usage from the response
-                input_tokens = getattr(response.usage, "input_tokens", 0)
-                output_tokens = getattr(response.usage, "output_tokens", 0)
-                self.logger.info(
-                    f"API usage: input_tokens={input_tokens}, output_tokens={output_tokens}"
-                )
-
-                # Update token counts in SessionLogger
-                self.session_logger.update_token_usage(input_tokens, output_tokens)
-
-                self.logger.info(f"API response: {response.model_dump()}")
-
-                # Convert response content to message params
-                response_content = []
-                for block in response.content:
-                    if block.type == "text":
-                        response_content.append({"type": "text", "text": block.text})
-                    else:
-                        response_content.append(block.model_dump())
-
-                # Add assistant response to messages
-                self.messages.append({"role": "assistant", "content": response_content})
-
-                if response.stop_reason != "tool_use":
-                    print(response.content[0].text)
-                    break
-
-                tool_results = self.process_tool_calls(response.content)
-
-                # Add tool results as user message
-                if tool_results:
-                    self.messages.append(
-                        {"role": "user", "content": [tool_results[0]["output"]]}
-                    )
-
-                    if tool_results[0]["output"]["is_error"]:
-                        self.logger.error(
-                            f"Error: {tool_results[0]['output']['content']}"
-                        )
-                        break
-
-            # After the execution loop, log the total cost
-            self.session_logger.log_total_cost()
+            if resume:
+                final_text = self.resume(edit_prompt)
+            else:
+                final_text = self.run(edit_prompt)
+            if not self.stream:
+                print(final_text)
+            return final_text
 
         except Exception as e:
             self.logger.error(f"Error in process_edit: {str(e)}")
@@ -323,17 +1018,45 @@ class EditorSession:
             raise
 
 
-class BashSession:
-    def __init__(self, session_id: Optional[str] = None, no_agi: bool = False):
+class BashSession(AgentSession):
+    mode = "bash"
+    tools = [{"type": "bash_20241022", "name": "bash"}]
+    system_prompt = BASH_SYSTEM_PROMPT
+
+    def __init__(
+        self,
+        session_id: Optional[str] = None,
+        no_agi: bool = False,
+        command_timeout: Optional[float] = DEFAULT_TIMEOUT,
+        max_output_bytes: Optional[int] = DEFAULT_MAX_OUTPUT_BYTES,
+        cwd: Optional[str] = None,
+        sessions_dir: Optional[str] = None,
+        limits: Optional[ResourceLimits] = None,
+    ):
         """Initialize Bash session with optional existing session ID"""
         self.session_id = session_id or self._create_session_id()
-        self.sessions_dir = SESSIONS_DIR
-        self.client = anthropic.Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
+        self.sessions_dir = sessions_dir or SESSIONS_DIR
+        self.client = shared_client()
+        self.scheduler = shared_scheduler()
         self.messages = []
 
-        # Initialize a persistent environment dictionary for subprocesses
+        # Environment the persistent shell is (re)started with
         self.environment = os.environ.copy()
 
+        # A single bash child is kept alive for the whole session so that
+        # cwd, variables and functions persist between commands. Output is
+        # captured head+tail and commands are bounded in time and size.
+        self.shell = ShellProcess(
+            env=self.environment,
+            cwd=cwd,
+            timeout=command_timeout,
+            max_output_bytes=max_output_bytes,
+            limits=limits,
+        )
+
+        # Worker threads for tool calls
+        self.tool_executor = ToolExecutor()
+
         # Initialize logger placeholder
         self.logger = None
 
@@ -346,9 +1069,7 @@ class BashSession:
     def set_logger(self, session_logger: SessionLogger):
         """Set the logger for the session and store the SessionLogger instance."""
         self.session_logger = session_logger
-        self.logger = logging.LoggerAdapter(
-            session_logger.logger, {"prefix": self.log_prefix}
-        )
+        self.logger = session_logger.adapter(self.log_prefix)
 
     def _create_session_id(self) -> str:
         """Create a new session ID"""
@@ -364,6 +1085,8 @@ class BashSession:
 
             if restart:
                 self.environment = os.environ.copy()  # Reset the environment
+                self.shell.env = self.environment
+                self.shell.restart()
                 self.logger.info("Bash session restarted.")
                 return {"content": "Bash session restarted."}
 
@@ -373,38 +1096,84 @@ class BashSession:
 
             # Check if no_agi is enabled
             if self.no_agi:
-                self.logger.info(f"Mock executing bash command: {command}")
+                self.logger.event(
+                    "bash_command", "Mock executing bash command", command=command
+                )
                 return {"content": "in mock mode, command did not run"}
 
             # Log the command being executed
-            self.logger.info(f"Executing bash command: {command}")
-
-            # Execute the command in a subprocess
-            result = subprocess.run(
-                command,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                env=self.environment,
-                text=True,
-                executable="/bin/bash",
-            )
+            self.logger.event("bash_command", "Executing bash command", command=command)
+
+            # Execute the command in the persistent shell
+            try:
+                result = self.shell.run(command)
+            except ShellExited:
+                self.logger.error("Bash process exited, it will be restarted.")
+                error = (
+                    "Bash process exited. A fresh shell will be started on the "
+                    "next command."
+                )
+                if self.shell.limits is not None:
+                    error += " It may have hit its resource limits."
+                return {"error": error}
 
             output = result.stdout.strip()
             error_output = result.stderr.strip()
 
-            # Log the outputs
-            if output:
-                self.logger.info(
-                    f"Command output:\n\n```output for '{command[:20]}...'\n{output}\n```"
+            # Count usage before logging: tool_output events may be sampled
+            # out, the counters never are
+            command_type = self._command_type(tool_call)
+            if result.dropped_bytes:
+                self.session_logger.metrics.increment(
+                    "tool_output_dropped_bytes_total",
+                    result.dropped_bytes,
+                    command=command_type,
                 )
-            if error_output:
-                self.logger.error(
-                    f"Command error output:\n\n```error for '{command}'\n{error_output}\n```"
+            if result.usage:
+                cpu = result.usage.get("cpu_seconds")
+                if cpu is None:
+                    cpu = (
+                        result.usage["cpu_user_seconds"]
+                        + result.usage["cpu_system_seconds"]
+                    )
+                self.session_logger.metrics.increment(
+                    "tool_cpu_seconds_total", cpu, command=command_type
                 )
 
+            # Log the outputs; the listener truncates them to the payload limit
+            self.logger.event(
+                "tool_output",
+                "Command finished",
+                level=logging.INFO if result.returncode == 0 else logging.ERROR,
+                command=command,
+                returncode=result.returncode,
+                stdout=output,
+                stderr=error_output,
+                dropped_bytes=result.dropped_bytes,
+                usage=result.usage,
+                limits=self.shell.applied_limits,
+            )
+
+            if result.timed_out or result.output_limited:
+                reason = (
+                    f"timed out after {self.shell.timeout}s"
+                    if result.timed_out
+                    else f"exceeded {self.shell.max_output_bytes} bytes of output"
+                )
+                self.logger.error(f"Command {reason}, process group killed.")
+                partial = "\n".join(part for part in (output, error_output) if part)
+                return {
+                    "error": f"Command {reason} and was killed; the shell will be "
+                    f"restarted on the next command.\n{partial}".rstrip()
+                }
+
             if result.returncode != 0:
                 error_message = error_output or "Command execution failed."
+                if self.shell.limits is not None:
+                    note = self.shell.limits.describe_exit(result.returncode)
+                    if note:
+                        self.logger.error(note)
+                        error_message = f"{error_message}\n{note}"
                 return {"error": error_message}
 
             return {"content": output}
@@ -414,147 +1183,530 @@ class BashSession:
             self.logger.error(traceback.format_exc())
             return {"error": str(e)}
 
-    def process_tool_calls(
-        self, tool_calls: List[anthropic.types.ContentBlock]
-    ) -> List[Dict[str, Any]]:
-        """Process tool calls and return results"""
-        results = []
-
-        for tool_call in tool_calls:
-            if tool_call.type == "tool_use" and tool_call.name == "bash":
-                self.logger.info(f"Bash tool call input: {tool_call.input}")
-
-                result = self._handle_bash_command(tool_call.input)
-
-                # Convert result to match expected tool result format
-                is_error = False
-
-                if result.get("error"):
-                    is_error = True
-                    tool_result_content = [{"type": "text", "text": result["error"]}]
-                else:
-                    tool_result_content = [
-                        {"type": "text", "text": result.get("content", "")}
-                    ]
-
-                results.append(
-                    {
-                        "tool_call_id": tool_call.id,
-                        "output": {
-                            "type": "tool_result",
-                            "content": tool_result_content,
-                            "tool_use_id": tool_call.id,
-                            "is_error": is_error,
-                        },
-                    }
-                )
+    def close(self) -> None:
+        """Stop the persistent bash process and the tool worker threads"""
+        self.tool_executor.shutdown()
+        self.shell.stop()
+
+    def _submit_tool_call(
+        self, batch: ToolBatch, tool_call: anthropic.types.ContentBlock
+    ) -> None:
+        """Schedule a bash tool call
+
+        All commands share one stateful shell, so they run in order.
+        """
+        if tool_call.type == "tool_use" and tool_call.name == "bash":
+            self.logger.event(
+                "tool_call",
+                "Bash tool call",
+                tool_use_id=tool_call.id,
+                input=tool_call.input,
+            )
+            batch.submit(self._run_tool_call, tool_call, key="shell")
 
-        return results
+    def _run_tool_call(self, tool_call: anthropic.types.ContentBlock) -> Dict[str, Any]:
+        """Run a single bash tool call and format its result"""
+        return self._timed_tool_call(
+            tool_call, self._command_type(tool_call.input), self._handle_bash_command
+        )
 
-    def process_bash_command(self, bash_prompt: str) -> None:
+    @staticmethod
+    def _command_type(tool_input: Dict[str, Any]) -> str:
+        """Metrics label for a bash call: the program a command starts with"""
+        if tool_input.get("restart"):
+            return "restart"
+        words = str(tool_input.get("command", "")).split(None, 1)
+        return os.path.basename(words[0]) if words else "none"
+
+    def process_bash_command(
+        self, bash_prompt: Optional[str], resume: bool = False
+    ) -> str:
         """Main method to process bash commands via the assistant"""
         try:
-            # Initial message with proper content structure
-            api_message = {
-                "role": "user",
-                "content": [{"type": "text", "text": bash_prompt}],
-            }
-            self.messages = [api_message]
-
-            self.logger.info(f"User input: {api_message}")
-
-            while True:
-                response = self.client.beta.messages.create(
-                    model="claude-3-5-sonnet-20241022",
-                    max_tokens=4096,
-                    messages=self.messages,
-                    tools=[{"type": "bash_20241022", "name": "bash"}],
-                    system=BASH_SYSTEM_PROMPT,
-                    betas=["computer-use-2024-10-22"],
-                )
+            if resume:
+                final_text = self.resume(bash_prompt)
+            else:
+                final_text = self.run(bash_prompt)
+            # Print the assistant's final response
+            if not self.stream:
+                print(final_text)
+            return final_text
 
-                # Extract token usage from the response
-                input_tokens = getattr(response.usage, "input_tokens", 0)
-                output_tokens = getattr(response.usage, "output_tokens", 0)
-                self.logger.info(
-                    f"API usage: input_tokens={input_tokens}, output_tokens={output_tokens}"
-                )
-
-                # Update token counts in SessionLogger
-                self.session_logger.update_token_usage(input_tokens, output_tokens)
+        except Exception as e:
+            self.logger.error(f"Error in process_bash_command: {str(e)}")
+            self.logger.error(traceback.format_exc())
+            raise
 
-                self.logger.info(f"API response: {response.model_dump()}")
 
-                # Convert response content to message params
-                response_content = []
-                for block in response.content:
-                    if block.type == "text":
-                        response_content.append({"type": "text", "text": block.text})
-                    else:
-                        response_content.append(block.model_dump())
+class UnifiedSession(EditorSession, BashSession):
+    """Editor and bash tools in one conversation, sharing a working directory
+
+    The shell starts in editor_dir, so a task such as "fix the function,
+    then run the tests" takes one session instead of two, and files are
+    edited with the editor instead of being rewritten through heredocs.
+    """
+
+    mode = "combined"
+    tools = EditorSession.tools + BashSession.tools
+
+    def __init__(
+        self,
+        session_id: Optional[str] = None,
+        editor_dir: Optional[str] = None,
+        sessions_dir: Optional[str] = None,
+        no_agi: bool = False,
+        command_timeout: Optional[float] = DEFAULT_TIMEOUT,
+        max_output_bytes: Optional[int] = DEFAULT_MAX_OUTPUT_BYTES,
+        limits: Optional[ResourceLimits] = None,
+    ):
+        """Initialize combined session with optional existing session ID"""
+        EditorSession.__init__(
+            self,
+            session_id=session_id,
+            editor_dir=editor_dir,
+            sessions_dir=sessions_dir,
+        )
 
-                # Add assistant response to messages
-                self.messages.append({"role": "assistant", "content": response_content})
+        # Persistent shell, as in BashSession, rooted at the editor directory
+        self.environment = os.environ.copy()
+        self.shell = ShellProcess(
+            env=self.environment,
+            cwd=self.editor_dir,
+            timeout=command_timeout,
+            max_output_bytes=max_output_bytes,
+            limits=limits,
+        )
+        self.no_agi = no_agi
 
-                if response.stop_reason != "tool_use":
-                    # Print the assistant's final response
-                    print(response.content[0].text)
-                    break
+        self.system_prompt = (
+            f"{COMBINED_SYSTEM_PROMPT}\n\nThe bash shell starts in "
+            f"{self.editor_dir}, and relative editor paths resolve against the "
+            "same directory, so the files you edit are the ones your commands see."
+        )
 
-                tool_results = self.process_tool_calls(response.content)
+        # Set log prefix
+        self.log_prefix = "🧰 combined"
+
+    def _submit_tool_call(
+        self, batch: ToolBatch, tool_call: anthropic.types.ContentBlock
+    ) -> None:
+        """Schedule an editor or bash tool call
+
+        A command may read or change any file, so all calls are ordered on
+        one key; consecutive editor views can still overlap.
+        """
+        if tool_call.type != "tool_use":
+            return
+        if tool_call.name == "bash":
+            self.logger.event(
+                "tool_call",
+                "Bash tool call",
+                tool_use_id=tool_call.id,
+                input=tool_call.input,
+            )
+            batch.submit(self._run_tool_call, tool_call, key="workspace")
+        elif tool_call.name == "str_replace_editor":
+            self.logger.event(
+                "tool_call",
+                f"Editor tool call: {tool_call.input.get('command')}",
+                tool_use_id=tool_call.id,
+                input=tool_call.input,
+            )
+            batch.submit(
+                self._run_tool_call,
+                tool_call,
+                key="workspace",
+                readonly=tool_call.input.get("command") == "view",
+            )
 
-                # Add tool results as user message
-                if tool_results:
-                    self.messages.append(
-                        {"role": "user", "content": [tool_results[0]["output"]]}
-                    )
+    def _run_tool_call(self, tool_call: anthropic.types.ContentBlock) -> Dict[str, Any]:
+        """Route a tool call to the bash or editor handler"""
+        if tool_call.name == "bash":
+            return BashSession._run_tool_call(self, tool_call)
+        return EditorSession._run_tool_call(self, tool_call)
 
-                    if tool_results[0]["output"]["is_error"]:
-                        self.logger.error(
-                            f"Error: {tool_results[0]['output']['content']}"
-                        )
-                        break
+    def close(self) -> None:
+        """Stop the persistent bash process and the tool worker threads"""
+        BashSession.close(self)
 
-            # After the execution loop, log the total cost
-            self.session_logger.log_total_cost()
+    def process_task(self, prompt: Optional[str], resume: bool = False) -> str:
+        """Main method to process prompts that need both tools"""
+        try:
+            if resume:
+                final_text = self.resume(prompt)
+            else:
+                final_text = self.run(prompt)
+            if not self.stream:
+                print(final_text)
+            return final_text
 
         except Exception as e:
-            self.logger.error(f"Error in process_bash_command: {str(e)}")
+            self.logger.error(f"Error in process_task: {str(e)}")
             self.logger.error(traceback.format_exc())
             raise
 
 
-def main():
-    """Main entry point"""
-    parser = argparse.ArgumentParser()
+def manage_sessions(
+    store: Optional[SessionStore], args: argparse.Namespace, sessions_dir: str
+) -> None:
+    """Handle --list-sessions and --prune-sessions"""
+    if store is None:
+        print("The session store is disabled.")
+        return
+    if args.prune_sessions is not None:
+        pruned = store.prune(args.prune_sessions)
+        names = os.listdir(sessions_dir) if os.path.isdir(sessions_dir) else []
+        for session_id in pruned:
+            for name in names:
+                if name.startswith(session_id + "."):
+                    os.remove(os.path.join(sessions_dir, name))
+        print(f"Pruned {len(pruned)} session(s).")
+    if args.list_sessions:
+        for row in store.list_sessions():
+            updated = datetime.fromtimestamp(row["updated"]).strftime("%Y-%m-%d %H:%M")
+            prompt = (row["prompt"] or "").replace("\n", " ")
+            print(
+                f"{row['id']}  {row['mode']:6}  {row['status']:11}  "
+                f"{row['turns']:4} turns  {updated}  {prompt[:60]}"
+            )
+
+
+def workspace_paths(cwd: Optional[str] = None) -> Dict[str, str]:
+    """Editor, log, cache and store locations relative to a working directory"""
+    cwd = cwd or os.getcwd()
+    return {
+        "editor_dir": os.path.join(cwd, "editor_dir"),
+        "sessions_dir": os.path.join(cwd, "sessions"),
+        "response_cache_dir": os.path.join(cwd, "data", "response_cache"),
+        "session_store_path": os.path.join(cwd, "data", "sessions.db"),
+    }
+
+
+def build_parser(prog: Optional[str] = None) -> argparse.ArgumentParser:
+    """Command line options of a session run"""
+    parser = argparse.ArgumentParser(prog=prog)
     parser.add_argument("prompt", help="The prompt for Claude", nargs="?")
     parser.add_argument(
-        "--mode", choices=["editor", "bash"], default="editor", help="Mode to run"
+        "--mode",
+        choices=SESSION_MODES,
+        default="editor",
+        help="Mode to run; combined gives the model both tools in one session",
     )
     parser.add_argument(
         "--no-agi",
         action="store_true",
         help="When set, commands will not be executed, but will return 'command ran'.",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--command-timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help="Wall-clock limit in seconds for each bash command.",
+    )
+    parser.add_argument(
+        "--max-output-bytes",
+        type=int,
+        default=DEFAULT_MAX_OUTPUT_BYTES,
+        help="Kill a bash command once it has printed this many bytes.",
+    )
+    parser.add_argument(
+        "--limit-cpu",
+        type=int,
+        metavar="SECONDS",
+        help="CPU time each process started by a bash command may use.",
+    )
+    parser.add_argument(
+        "--limit-memory-mb",
+        type=int,
+        help="Address space limit of each process a bash command starts.",
+    )
+    parser.add_argument(
+        "--limit-processes",
+        type=int,
+        help="Process limit for bash commands (per user, or per shell with --cgroup).",
+    )
+    parser.add_argument(
+        "--limit-file-size-mb",
+        type=int,
+        help="Largest file a bash command may write.",
+    )
+    parser.add_argument(
+        "--limit-cpus",
+        type=float,
+        help="CPU share of a session's shell, e.g. 1.5 (requires --cgroup).",
+    )
+    parser.add_argument(
+        "--nice",
+        type=int,
+        default=0,
+        help="Run bash commands at this niceness so the agent stays responsive.",
+    )
+    parser.add_argument(
+        "--cgroup",
+        action="store_true",
+        help="Put each shell in its own cgroup v2 group when delegation allows it.",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="JSONL file of prompts to run as independent concurrent sessions.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Maximum number of batch sessions running at once.",
+    )
+    parser.add_argument(
+        "--no-prompt-cache",
+        action="store_true",
+        help="Send requests without prompt cache breakpoints.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream responses, printing text as it arrives and starting tools early.",
+    )
+    parser.add_argument(
+        "--context-budget",
+        type=int,
+        default=AgentSession.context_budget,
+        help="Estimated token budget above which old tool output is elided.",
+    )
+    parser.add_argument(
+        "--result-token-budget",
+        type=int,
+        default=AgentSession.result_token_budget,
+        help="Cut each tool result to about this many tokens (0 to disable).",
+    )
+    parser.add_argument(
+        "--log-payload-chars",
+        type=int,
+        default=DEFAULT_PAYLOAD_CHARS,
+        help="Truncate logged payload strings to this many characters.",
+    )
+    parser.add_argument(
+        "--log-sample-rate",
+        type=float,
+        default=1.0,
+        help="Fraction of API response and tool payload events to log.",
+    )
+    parser.add_argument(
+        "--metrics-prometheus-dir",
+        metavar="DIR",
+        help="Also write each session's metrics as a Prometheus textfile here.",
+    )
+    parser.add_argument(
+        "--response-cache",
+        choices=RESPONSE_CACHE_MODES,
+        default="off",
+        help="Record API responses on disk and/or replay them for identical requests.",
+    )
+    parser.add_argument(
+        "--response-cache-dir",
+        help="Directory of the response cache (default: data/response_cache).",
+    )
+    parser.add_argument(
+        "--response-cache-max-mb",
+        type=int,
+        default=DEFAULT_CACHE_BYTES // (1024 * 1024),
+        help="Evict least recently used responses beyond this size.",
+    )
+    parser.add_argument(
+        "--resume",
+        metavar="SESSION_ID",
+        help="Continue a stored session; the prompt, if given, is added to it.",
+    )
+    parser.add_argument(
+        "--list-sessions",
+        action="store_true",
+        help="List stored sessions, most recent first.",
+    )
+    parser.add_argument(
+        "--prune-sessions",
+        type=float,
+        metavar="DAYS",
+        help="Delete stored sessions and their logs not updated in DAYS days.",
+    )
+    parser.add_argument(
+        "--no-session-store",
+        action="store_true",
+        help="Do not persist conversations to data/sessions.db.",
+    )
+    return parser
+
+
+def main(
+    argv: Optional[List[str]] = None,
+    cwd: Optional[str] = None,
+    console_stream: Optional[IO[str]] = None,
+    resident: Optional[Any] = None,
+    prog: Optional[str] = None,
+):
+    """Main entry point
+
+    The resident daemon calls this once per client command, passing the
+    client's arguments and working directory, the stream its log lines go
+    to, and a `resident` state that hands out long-lived stores, caches and
+    sessions instead of creating them for a single run.
+    """
+    parser = build_parser(prog)
+    args = parser.parse_args(argv)
+    cwd = cwd or os.getcwd()
+    paths = workspace_paths(cwd)
+    log_options = {
+        "max_payload_chars": args.log_payload_chars,
+        "sample_rate": args.log_sample_rate,
+        "prometheus_dir": (
+            os.path.join(cwd, args.metrics_prometheus_dir)
+            if args.metrics_prometheus_dir
+            else None
+        ),
+        "console_stream": console_stream,
+    }
+
+    response_cache = None
+    if args.response_cache != "off":
+        cache_dir = os.path.join(
+            cwd, args.response_cache_dir or paths["response_cache_dir"]
+        )
+        max_bytes = args.response_cache_max_mb * 1024 * 1024
+        if resident is not None:
+            response_cache = resident.response_cache(
+                cache_dir, args.response_cache, max_bytes
+            )
+        else:
+            response_cache = ResponseCache(
+                cache_dir, mode=args.response_cache, max_bytes=max_bytes
+            )
 
-    # Create a shared session ID
-    session_id = datetime.now().strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+    store = None
+    if not args.no_session_store:
+        if resident is not None:
+            store = resident.store(paths["session_store_path"])
+        else:
+            store = SessionStore(paths["session_store_path"])
+    if args.list_sessions or args.prune_sessions is not None:
+        manage_sessions(store, args, paths["sessions_dir"])
+        return
+
+    megabyte = 1024 * 1024
+    limits = ResourceLimits(
+        cpu_seconds=args.limit_cpu,
+        memory_bytes=args.limit_memory_mb * megabyte if args.limit_memory_mb else None,
+        max_processes=args.limit_processes,
+        file_size_bytes=(
+            args.limit_file_size_mb * megabyte if args.limit_file_size_mb else None
+        ),
+        cpus=args.limit_cpus,
+        nice=args.nice,
+        cgroup=args.cgroup,
+    )
+
+    settings = {
+        "prompt_caching": not args.no_prompt_cache,
+        "context_budget": args.context_budget,
+        "result_token_budget": args.result_token_budget,
+        "stream": args.stream,
+        "response_cache": response_cache,
+        "session_store": store,
+    }
+
+    if args.batch:
+        import asyncio
+
+        if args.stream:
+            parser.error("--stream cannot be combined with --batch")
+
+        from .batch import load_jobs, run_batch
+
+        try:
+            jobs = load_jobs(os.path.join(cwd, args.batch), args.mode)
+        except ValueError as e:
+            parser.error(str(e))
+        results = asyncio.run(
+            run_batch(
+                jobs,
+                args.concurrency,
+                log_options=log_options,
+                settings=settings,
+                sessions_dir=paths["sessions_dir"],
+                editor_dir=paths["editor_dir"],
+                cwd=cwd,
+                no_agi=args.no_agi,
+                command_timeout=args.command_timeout,
+                max_output_bytes=args.max_output_bytes,
+                limits=limits,
+            )
+        )
+        for result in results:
+            print(json.dumps(result))
+        return
+
+    if args.resume:
+        if store is None:
+            parser.error("--resume cannot be combined with --no-session-store")
+        try:
+            stored = store.get_session(args.resume)
+        except SessionNotFound as e:
+            parser.error(str(e))
+        session_id, args.mode = args.resume, stored["mode"]
+    elif not args.prompt:
+        parser.error("a prompt is required unless resuming a session")
+    else:
+        # Create a shared session ID
+        session_id = new_session_id()
     # Create a single SessionLogger instance
-    session_logger = SessionLogger(session_id, SESSIONS_DIR)
-
-    if args.mode == "editor":
-        session = EditorSession(session_id=session_id)
-        # Pass the logger via setter method
-        session.set_logger(session_logger)
-        print(f"Session ID: {session.session_id}")
-        session.process_edit(args.prompt)
-    elif args.mode == "bash":
-        session = BashSession(session_id=session_id, no_agi=args.no_agi)
-        # Pass the logger via setter method
-        session.set_logger(session_logger)
-        print(f"Session ID: {session.session_id}")
-        session.process_bash_command(args.prompt)
+    session_logger = SessionLogger(session_id, paths["sessions_dir"], **log_options)
+    resume = bool(args.resume)
+
+    # A resident daemon may still hold the session, with its shell alive
+    session = resident.checkout(session_id) if resident is not None else None
+    if session is None and args.mode == "editor":
+        session = EditorSession(
+            session_id=session_id,
+            editor_dir=paths["editor_dir"],
+            sessions_dir=paths["sessions_dir"],
+        )
+    elif session is None and args.mode == "combined":
+        session = UnifiedSession(
+            session_id=session_id,
+            editor_dir=paths["editor_dir"],
+            sessions_dir=paths["sessions_dir"],
+            no_agi=args.no_agi,
+            command_timeout=args.command_timeout,
+            max_output_bytes=args.max_output_bytes,
+            limits=limits,
+        )
+    elif session is None:
+        session = BashSession(
+            session_id=session_id,
+            no_agi=args.no_agi,
+            command_timeout=args.command_timeout,
+            max_output_bytes=args.max_output_bytes,
+            limits=limits,
+            cwd=cwd,
+            sessions_dir=paths["sessions_dir"],
+        )
+    session.configure(**settings)
+    # Pass the logger via setter method
+    session.set_logger(session_logger)
+    print(f"Session ID: {session.session_id}")
+    try:
+        if args.mode == "editor":
+            session.process_edit(args.prompt, resume=resume)
+        elif args.mode == "combined":
+            session.process_task(args.prompt, resume=resume)
+        else:
+            session.process_bash_command(args.prompt, resume=resume)
+    finally:
+        if resident is not None:
+            resident.checkin(session)
+        else:
+            session.close()
+            if store is not None:
+                store.close()
+        session_logger.close()
 
 
 if __name__ == "__main__":
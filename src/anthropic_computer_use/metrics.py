@@ -0,0 +1,285 @@
+import json
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .file_cache import atomic_write
+
+# Upper bounds in seconds, shared by the latency histograms
+LATENCY_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)  # fmt: skip
+THROUGHPUT_BUCKETS = (1, 5, 10, 25, 50, 75, 100, 150, 200, 300, 500, 1000)
+
+# name -> (type, buckets, help); every metric carries a `session` label
+METRICS = {
+    "api_latency_seconds": (
+        "histogram",
+        LATENCY_BUCKETS,
+        "Wall time of each Messages API call",
+    ),
+    "time_to_first_token_seconds": (
+        "histogram",
+        LATENCY_BUCKETS,
+        "Time until the first content delta of a streamed response",
+    ),
+    "output_tokens_per_second": (
+        "histogram",
+        THROUGHPUT_BUCKETS,
+        "Output tokens per second of API wall time",
+    ),
+    "tool_duration_seconds": (
+        "histogram",
+        LATENCY_BUCKETS,
+        "Execution time of each tool call",
+    ),
+    "rate_limit_wait_seconds": (
+        "histogram",
+        LATENCY_BUCKETS,
+        "Time an API call spent queued for rate limits or backing off",
+    ),
+    "turns_total": ("counter", None, "Assistant turns in the session"),
+    "api_retries_total": ("counter", None, "API calls retried after an error"),
+    "tool_calls_total": ("counter", None, "Tool calls executed"),
+    "tool_errors_total": ("counter", None, "Tool calls that returned an error"),
+    "tool_input_bytes_total": ("counter", None, "Bytes of tool call input"),
+    "tool_output_bytes_total": ("counter", None, "Bytes of tool result content"),
+    "tool_output_dropped_bytes_total": (
+        "counter",
+        None,
+        "Bytes of bash output dropped from the middle of captures",
+    ),
+    "tool_cpu_seconds_total": (
+        "counter",
+        None,
+        "CPU seconds used by bash commands, per command",
+    ),
+    "tool_result_tokens_trimmed_total": (
+        "counter",
+        None,
+        "Estimated tokens removed from tool results by result shaping",
+    ),
+    "response_cache_hits_total": (
+        "counter",
+        None,
+        "API responses replayed from the response cache",
+    ),
+}
+
+PROMETHEUS_NAMESPACE = "acu"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Fixed-bucket histogram with count, sum, min and max"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value: float) -> None:
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile by interpolating inside its bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, count in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.max
+            if count and seen + count >= rank:
+                estimate = lower + (upper - lower) * (rank - seen) / count
+                return round(min(max(estimate, self.min), self.max), 6)
+            seen += count
+            lower = upper
+        return round(self.max, 6)
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "min": round(self.min, 6) if self.count else None,
+            "max": round(self.max, 6) if self.count else None,
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)),
+        }
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+class SessionMetrics:
+    """Latency histograms and throughput counters for one session.
+
+    Tool calls run on worker threads, so every update takes a lock. The
+    totals answer whether a session spent its time waiting on the model
+    or on tools.
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.started = time.time()
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        buckets = METRICS[name][1]
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def record_api_call(
+        self,
+        latency: float,
+        output_tokens: int,
+        first_token: Optional[float] = None,
+        queued: float = 0.0,
+        retries: int = 0,
+    ) -> None:
+        self.observe("api_latency_seconds", latency)
+        if queued:
+            self.observe("rate_limit_wait_seconds", queued)
+        if retries:
+            self.increment("api_retries_total", retries)
+        if latency > 0 and output_tokens:
+            self.observe("output_tokens_per_second", output_tokens / latency)
+        if first_token is not None:
+            self.observe("time_to_first_token_seconds", first_token)
+
+    def record_tool_call(
+        self,
+        tool: str,
+        command: str,
+        duration: float,
+        bytes_in: int,
+        bytes_out: int,
+        is_error: bool = False,
+    ) -> None:
+        labels = {"tool": tool, "command": command}
+        self.observe("tool_duration_seconds", duration, **labels)
+        self.increment("tool_calls_total", **labels)
+        self.increment("tool_input_bytes_total", bytes_in, **labels)
+        self.increment("tool_output_bytes_total", bytes_out, **labels)
+        if is_error:
+            self.increment("tool_errors_total", **labels)
+
+    def _total(self, name: str) -> float:
+        return sum(h.sum for h in self._histograms.get(name, {}).values())
+
+    def to_dict(self) -> Dict[str, object]:
+        with self._lock:
+            histograms = {
+                name: [
+                    {"labels": dict(labels), **histogram.to_dict()}
+                    for labels, histogram in series.items()
+                ]
+                for name, series in self._histograms.items()
+            }
+            counters = {
+                name: [
+                    {"labels": dict(labels), "value": value}
+                    for labels, value in series.items()
+                ]
+                for name, series in self._counters.items()
+            }
+            summary = {
+                "wall_seconds": round(time.time() - self.started, 6),
+                "api_seconds": round(self._total("api_latency_seconds"), 6),
+                "tool_seconds": round(self._total("tool_duration_seconds"), 6),
+                "turns": int(sum(self._counters.get("turns_total", {}).values())),
+                "tool_calls": int(
+                    sum(self._counters.get("tool_calls_total", {}).values())
+                ),
+                "tool_cpu_seconds": round(
+                    sum(self._counters.get("tool_cpu_seconds_total", {}).values()), 6
+                ),
+            }
+        return {
+            "session_id": self.session_id,
+            "started": self.started,
+            "summary": summary,
+            "histograms": histograms,
+            "counters": counters,
+        }
+
+    def write_json(self, path: str) -> None:
+        atomic_write(path, json.dumps(self.to_dict(), indent=2))
+
+    def prometheus_text(self) -> str:
+        """Render the metrics in the Prometheus text exposition format"""
+        lines: List[str] = []
+        session = ("session", self.session_id)
+        with self._lock:
+            for name, (kind, _, help_text) in METRICS.items():
+                if kind == "histogram":
+                    series = self._histograms.get(name)
+                else:
+                    series = self._counters.get(name)
+                if not series:
+                    continue
+                full_name = f"{PROMETHEUS_NAMESPACE}_{name}"
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} {kind}")
+                for labels, value in series.items():
+                    base = (session,) + labels
+                    if kind == "counter":
+                        lines.append(f"{full_name}{_format_labels(base)} {value}")
+                        continue
+                    cumulative = 0
+                    bounds = [str(b) for b in value.buckets] + ["+Inf"]
+                    for bound, count in zip(bounds, value.counts):
+                        cumulative += count
+                        bucket_labels = _format_labels(base + (("le", bound),))
+                        lines.append(f"{full_name}_bucket{bucket_labels} {cumulative}")
+                    lines.append(f"{full_name}_sum{_format_labels(base)} {value.sum}")
+                    lines.append(
+                        f"{full_name}_count{_format_labels(base)} {value.count}"
+                    )
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        """Write a textfile-collector file, replaced atomically for scrapers"""
+        atomic_write(path, self.prometheus_text())
@@ -0,0 +1,206 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+# One scripted assistant turn: the inputs of the tool calls it makes
+Turn = List[Dict[str, Any]]
+
+
+class MockMessagesServer:
+    """Local stand-in for the beta Messages endpoint, replaying scripted turns.
+
+    The n-th request of a conversation (counted by its assistant messages)
+    gets the tool calls of `turns[n]`, addressed to the request's first
+    tool; once the script runs out the model "finishes" with end_turn.
+    Every response waits `latency` seconds first. `stream: true` requests
+    get the same response as server-sent events.
+    """
+
+    def __init__(
+        self,
+        turns: List[Turn],
+        latency: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        final_text: str = "done",
+    ):
+        self.turns = turns
+        self.latency = latency
+        self.final_text = final_text
+        self.requests = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockMessagesServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "MockMessagesServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def respond(self, body: Dict[str, Any], raw_size: int) -> Dict[str, Any]:
+        """Build the scripted Message for a request body"""
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += raw_size
+
+        turn = sum(1 for message in body["messages"] if message["role"] == "assistant")
+        tool = body["tools"][0]["name"] if body.get("tools") else None
+        if tool and turn < len(self.turns):
+            content: List[Dict[str, Any]] = [{"type": "text", "text": f"turn {turn}"}]
+            content.extend(
+                {
+                    "type": "tool_use",
+                    "id": f"toolu_{turn:04d}_{index}",
+                    "name": tool,
+                    "input": tool_input,
+                }
+                for index, tool_input in enumerate(self.turns[turn])
+            )
+            stop_reason = "tool_use"
+        else:
+            content = [{"type": "text", "text": self.final_text}]
+            stop_reason = "end_turn"
+
+        return {
+            "id": f"msg_mock_{turn:04d}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "mock"),
+            "content": content,
+            "stop_reason": stop_reason,
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": raw_size // 4 + 1,
+                "output_tokens": len(json.dumps(content)) // 4 + 1,
+                "cache_creation_input_tokens": 0,
+                "cache_read_input_tokens": 0,
+            },
+        }
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; with Nagle on,
+            # delayed ACKs would add ~40 ms to every response
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("content-length", 0)))
+                if not self.path.startswith("/v1/messages"):
+                    error = {"type": "not_found_error", "message": self.path}
+                    self._send_json(404, {"type": "error", "error": error})
+                    return
+                body = json.loads(raw)
+                message = server.respond(body, len(raw))
+                if server.latency:
+                    time.sleep(server.latency)
+                if body.get("stream"):
+                    self._send_events(message)
+                else:
+                    self._send_json(200, message)
+
+            def _send_json(self, status: int, data: Dict[str, Any]) -> None:
+                payload = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_events(self, message: Dict[str, Any]) -> None:
+                self.send_response(200)
+                self.send_header("content-type", "text/event-stream")
+                self.send_header("connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                for event in stream_events(message):
+                    self.wfile.write(
+                        f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode()
+                    )
+                self.wfile.flush()
+
+        return Handler
+
+
+def stream_events(message: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Split a Message into the server-sent events that would stream it"""
+    start = dict(message, content=[], stop_reason=None)
+    start["usage"] = dict(message["usage"], output_tokens=1)
+    events: List[Dict[str, Any]] = [{"type": "message_start", "message": start}]
+    for index, block in enumerate(message["content"]):
+        if block["type"] == "text":
+            opening = {"type": "text", "text": ""}
+            delta = {"type": "text_delta", "text": block["text"]}
+        else:
+            opening = dict(block, input={})
+            delta = {
+                "type": "input_json_delta",
+                "partial_json": json.dumps(block["input"]),
+            }
+        events.append(
+            {"type": "content_block_start", "index": index, "content_block": opening}
+        )
+        events.append({"type": "content_block_delta", "index": index, "delta": delta})
+        events.append({"type": "content_block_stop", "index": index})
+    events.append(
+        {
+            "type": "message_delta",
+            "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+            "usage": {"output_tokens": message["usage"]["output_tokens"]},
+        }
+    )
+    events.append({"type": "message_stop"})
+    return events
+
+
+def main():
+    """Serve a JSON script of turns (a list of lists of tool inputs)"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("script", help="JSON file with the scripted turns")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    with open(args.script, "r") as f:
+        turns = json.load(f)
+    server = MockMessagesServer(turns, latency=args.latency, port=args.port)
+    print(f"Serving on {server.base_url} (set ANTHROPIC_BASE_URL to this)")
+    server.start()
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+from typing import Any, Dict, List, Tuple, Union
+
+EPHEMERAL = {"type": "ephemeral"}
+# Beta flag the API needs to honour cache_control on computer-use requests
+PROMPT_CACHING_BETA_FLAG = "prompt-caching-2024-07-31"
+
+# The API accepts at most four breakpoints per request: one covers the
+# tools+system prefix, the rest roll forward with the conversation.
+MESSAGE_BREAKPOINTS = 2
+
+
+def cached_system(
+    system: str, tools: List[Dict[str, Any]]
+) -> Tuple[Union[str, List[Dict[str, Any]]], List[Dict[str, Any]]]:
+    """Return system and tools with a cache breakpoint closing the static prefix.
+
+    Tools are rendered before the system prompt, so a breakpoint on the
+    system block caches both. An empty system prompt cannot carry one, in
+    which case the last tool gets it instead.
+    """
+    if system:
+        return [{"type": "text", "text": system, "cache_control": EPHEMERAL}], tools
+    if not tools:
+        return system, tools
+    return system, tools[:-1] + [{**tools[-1], "cache_control": EPHEMERAL}]
+
+
+def with_message_breakpoints(
+    messages: List[Dict[str, Any]], count: int = MESSAGE_BREAKPOINTS
+) -> List[Dict[str, Any]]:
+    """Mark the last block of the latest `count` user turns as cache breakpoints.
+
+    The conversation itself is left untouched: marked messages are shallow
+    copies, so breakpoints roll forward instead of accumulating. The newest
+    breakpoint writes the prefix for the next turn, the older one reads what
+    the previous turn wrote.
+    """
+    marked = list(messages)
+    remaining = count
+    for index in range(len(marked) - 1, -1, -1):
+        if remaining == 0:
+            break
+        message = marked[index]
+        content = message.get("content")
+        if message.get("role") != "user" or not isinstance(content, list) or not content:
+            continue
+        content = list(content)
+        content[-1] = {**content[-1], "cache_control": EPHEMERAL}
+        marked[index] = {**message, "content": content}
+        remaining -= 1
+    return marked
@@ -0,0 +1,343 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+import anthropic
+
+from .compaction import estimate_tokens
+
+# Budgets the API reports in anthropic-ratelimit-<name>-{limit,remaining}
+BUCKETS = ("requests", "input-tokens", "output-tokens")
+# Statuses worth retrying: timeouts, conflicts, throttling and overload
+RETRY_STATUSES = frozenset({408, 409, 429, 500, 502, 503, 504, 529})
+DEFAULT_MAX_RETRIES = 8
+BASE_BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 60.0
+# How often a queued async request checks whether it may go
+ASYNC_POLL_SECONDS = 0.01
+
+
+class TokenBucket:
+    """Per-minute budget, refilled continuously like the API's own limiter.
+
+    The limit is unknown until a response reports it; until then the bucket
+    never delays anything.
+    """
+
+    def __init__(self):
+        self.limit: Optional[float] = None
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.limit is not None:
+            elapsed = max(0.0, now - self.updated)
+            self.tokens = min(self.limit, self.tokens + elapsed * self.limit / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` is available (a full bucket always suffices)"""
+        if self.limit is None:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.limit)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60 / self.limit
+
+    def take(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.tokens -= amount
+
+    def give(self, amount: float, now: float) -> None:
+        self._refill(now)
+        if self.limit is not None:
+            self.tokens = min(self.limit, self.tokens + amount)
+
+    def observe(self, limit: float, remaining: float, now: float) -> None:
+        """Align with the server's view; requests still in flight stay deducted"""
+        first = self.limit is None
+        self._refill(now)
+        self.limit = limit
+        self.tokens = remaining if first else min(self.tokens, remaining)
+
+
+class Reservation:
+    """Budget taken for one request, settled once its usage is known"""
+
+    def __init__(self, input_tokens: int, output_tokens: int):
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.queued = 0.0
+        self.retries = 0
+
+
+def estimate_request(params: Dict[str, Any]) -> Tuple[int, int]:
+    """Estimated input tokens of a request and the output tokens it may use"""
+    text = json.dumps(
+        [params.get("system"), params.get("tools"), params.get("messages")],
+        separators=(",", ":"),
+        default=str,
+    )
+    return estimate_tokens(text), int(params.get("max_tokens") or 0)
+
+
+def _retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    value = headers.get("retry-after")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RateLimitScheduler:
+    """Admits Messages API calls against the account's rate limits.
+
+    Budgets for requests, input tokens and output tokens are kept as token
+    buckets sized from the anthropic-ratelimit-* headers of every response.
+    A request reserves its estimated input and its max_tokens of output
+    before it is sent and is refunded what it did not use. Requests are
+    admitted strictly in arrival order, so sessions share the quota fairly
+    and one large request is not starved by a stream of small ones. Until
+    the first response has reported the limits, one request goes at a time.
+
+    Throttled (429) and overloaded (529) responses, 5xx errors and
+    connection failures are retried with exponential backoff and full
+    jitter. A 429 also pauses every queued request until its retry-after,
+    since the limit it hit is shared by all of them.
+    """
+
+    def __init__(self, max_retries: int = DEFAULT_MAX_RETRIES):
+        self.max_retries = max_retries
+        self.buckets = {name: TokenBucket() for name in BUCKETS}
+        self.throttled = 0
+        self.retries = 0
+        self._paused_until = 0.0
+        self._calibrated = False
+        self._probing = False
+        self._queue: deque = deque()
+        self._condition = threading.Condition()
+
+    def _admit(self, ticket: object, amounts: Dict[str, float]) -> Optional[float]:
+        """Take the budget if `ticket` may go now (returns 0.0); else the wait
+
+        None means the ticket is not at the head of the queue yet. The caller
+        holds the condition.
+        """
+        if self._queue[0] is not ticket:
+            return None
+        if not self._calibrated:
+            if self._probing:
+                return None
+            self._probing = True
+        now = time.monotonic()
+        wait = max(
+            self._paused_until - now,
+            *(self.buckets[name].wait_time(amounts[name], now) for name in BUCKETS),
+        )
+        if wait > 0:
+            return wait
+        for name in BUCKETS:
+            self.buckets[name].take(amounts[name], now)
+        self._queue.popleft()
+        self._condition.notify_all()
+        return 0.0
+
+    def _enqueue(self, ticket: object, front: bool) -> None:
+        with self._condition:
+            if front:
+                self._queue.appendleft(ticket)
+            else:
+                self._queue.append(ticket)
+
+    def _abandon(self, ticket: object) -> None:
+        with self._condition:
+            try:
+                self._queue.remove(ticket)
+            except ValueError:
+                pass
+            self._condition.notify_all()
+
+    def acquire(self, reservation: Reservation, front: bool = False) -> None:
+        """Block until the reservation's budget is available, then take it"""
+        amounts = self._amounts(reservation)
+        ticket = object()
+        started = time.monotonic()
+        self._enqueue(ticket, front)
+        waited = False
+        try:
+            with self._condition:
+                while True:
+                    wait = self._admit(ticket, amounts)
+                    if wait == 0.0:
+                        break
+                    waited = True
+                    self._condition.wait(wait)
+        except BaseException:
+            self._abandon(ticket)
+            raise
+        if waited:
+            reservation.queued += time.monotonic() - started
+
+    async def aacquire(self, reservation: Reservation, front: bool = False) -> None:
+        """acquire() for coroutines: waits with asyncio.sleep instead of blocking"""
+        amounts = self._amounts(reservation)
+        ticket = object()
+        started = time.monotonic()
+        self._enqueue(ticket, front)
+        waited = False
+        try:
+            while True:
+                with self._condition:
+                    wait = self._admit(ticket, amounts)
+                if wait == 0.0:
+                    break
+                waited = True
+                await asyncio.sleep(min(wait or ASYNC_POLL_SECONDS, 1.0))
+        except BaseException:
+            self._abandon(ticket)
+            raise
+        if waited:
+            reservation.queued += time.monotonic() - started
+
+    @staticmethod
+    def _amounts(reservation: Reservation) -> Dict[str, float]:
+        return {
+            "requests": 1,
+            "input-tokens": reservation.input_tokens,
+            "output-tokens": reservation.output_tokens,
+        }
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        """Resize the buckets from the rate-limit headers of a response"""
+        now = time.monotonic()
+        with self._condition:
+            self._calibrated = True
+            for name in BUCKETS:
+                limit = headers.get(f"anthropic-ratelimit-{name}-limit")
+                remaining = headers.get(f"anthropic-ratelimit-{name}-remaining")
+                if limit is None or remaining is None:
+                    continue
+                try:
+                    self.buckets[name].observe(float(limit), float(remaining), now)
+                except ValueError:
+                    continue
+            self._condition.notify_all()
+
+    def settle(self, reservation: Reservation, usage: Any = None) -> None:
+        """Correct the reservation by the usage of the response
+
+        Without usage (the request failed or was interrupted) the whole
+        reservation is refunded. Every admitted request must be settled,
+        or a probe left open would block all later requests.
+        """
+        if usage is None:
+            input_used, output_used, requests = 0, 0, 1
+        else:
+            input_used = (getattr(usage, "input_tokens", 0) or 0) + (
+                getattr(usage, "cache_creation_input_tokens", 0) or 0
+            )
+            output_used = getattr(usage, "output_tokens", 0) or 0
+            requests = 0
+        now = time.monotonic()
+        with self._condition:
+            self._probing = False
+            self.buckets["requests"].give(requests, now)
+            self.buckets["input-tokens"].give(reservation.input_tokens - input_used, now)
+            self.buckets["output-tokens"].give(
+                reservation.output_tokens - output_used, now
+            )
+            self._condition.notify_all()
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying `error`, or None to give up"""
+        if attempt >= self.max_retries:
+            return None
+        retry_after = None
+        if isinstance(error, anthropic.APIStatusError):
+            if error.status_code not in RETRY_STATUSES:
+                return None
+            self.observe(error.response.headers)
+            retry_after = _retry_after(error.response.headers)
+        elif not isinstance(error, anthropic.APIConnectionError):
+            return None
+
+        backoff = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2**attempt)
+        delay = random.uniform(0, backoff)
+        if retry_after is not None:
+            delay += retry_after
+        with self._condition:
+            self.retries += 1
+            if getattr(error, "status_code", None) == 429:
+                self.throttled += 1
+                self._paused_until = max(
+                    self._paused_until, time.monotonic() + delay
+                )
+        return delay
+
+    def create(
+        self, client: anthropic.Anthropic, params: Dict[str, Any], stream: bool = False
+    ) -> Tuple[Any, Reservation]:
+        """Send beta.messages.create once the budget allows, retrying failures
+
+        Returns the response (or event stream) and its reservation, to be
+        passed to settle() with the response usage.
+        """
+        reservation = Reservation(*estimate_request(params))
+        kwargs = dict(params, stream=True) if stream else params
+        attempt = 0
+        while True:
+            self.acquire(reservation, front=attempt > 0)
+            try:
+                raw = client.beta.messages.with_raw_response.create(**kwargs)
+            except Exception as e:
+                self.settle(reservation)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                reservation.retries = attempt
+                reservation.queued += delay
+                time.sleep(delay)
+                continue
+            except BaseException:
+                # Interrupted: give the budget back and let the next request go
+                self.settle(reservation)
+                raise
+            self.observe(raw.headers)
+            return raw.parse(), reservation
+
+    async def acreate(
+        self,
+        client: anthropic.AsyncAnthropic,
+        params: Dict[str, Any],
+        stream: bool = False,
+    ) -> Tuple[Any, Reservation]:
+        """create() for the async client"""
+        reservation = Reservation(*estimate_request(params))
+        kwargs = dict(params, stream=True) if stream else params
+        attempt = 0
+        while True:
+            await self.aacquire(reservation, front=attempt > 0)
+            try:
+                raw = await client.beta.messages.with_raw_response.create(**kwargs)
+            except Exception as e:
+                self.settle(reservation)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                reservation.retries = attempt
+                reservation.queued += delay
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled: give the budget back and let the next request go
+                self.settle(reservation)
+                raise
+            self.observe(raw.headers)
+            return raw.parse(), reservation
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+MODES = ("off", "record", "replay", "replay-or-record")
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+ENTRY_SUFFIX = ".json.z"
+# Eviction trims the cache to this fraction of its cap, so it does not
+# run again on the very next write
+_EVICT_TO = 0.9
+
+
+class ResponseCacheMiss(Exception):
+    """Raised in replay mode when a request has no recorded response"""
+
+
+def _strip_cache_control(value: Any) -> Any:
+    """Drop prompt-cache breakpoints, which do not change the response"""
+    if isinstance(value, dict):
+        return {
+            key: _strip_cache_control(item)
+            for key, item in value.items()
+            if key != "cache_control"
+        }
+    if isinstance(value, list):
+        return [_strip_cache_control(item) for item in value]
+    return value
+
+
+def request_key(params: Dict[str, Any]) -> str:
+    """Stable hash of the model, system prompt, tools and messages of a request"""
+    system = params.get("system") or []
+    if isinstance(system, str):
+        system = [{"type": "text", "text": system}]
+    canonical = _strip_cache_control(
+        {
+            "model": params.get("model"),
+            "system": system,
+            "tools": params.get("tools") or [],
+            "messages": params.get("messages") or [],
+        }
+    )
+    encoded = json.dumps(
+        canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class ResponseCache:
+    """Content-addressed store of API responses on disk.
+
+    Entries are zlib-compressed JSON files named by request_key, fanned out
+    over 256 subdirectories. Replays bump an entry's mtime, and once the
+    total size exceeds `max_bytes` the least recently used entries are
+    deleted. Modes:
+
+    - record: always call the API and store the response
+    - replay: only serve stored responses; a miss raises ResponseCacheMiss
+    - replay-or-record: serve stored responses, record the misses
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        mode: str = "replay-or-record",
+        max_bytes: int = DEFAULT_CACHE_BYTES,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"Unknown response cache mode {mode!r}")
+        self.directory = directory
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._total_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key[2:] + ENTRY_SUFFIX)
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the recorded response for `key`, or None to call the API"""
+        if self.mode in ("off", "record"):
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = json.loads(zlib.decompress(f.read()))
+        except (FileNotFoundError, zlib.error, ValueError):
+            data = None
+
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if data is None:
+            if self.mode == "replay":
+                raise ResponseCacheMiss(f"No recorded response for request {key}")
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def store(self, key: str, data: Dict[str, Any]) -> None:
+        """Record a response, unless the cache only replays"""
+        if self.mode not in ("record", "replay-or-record"):
+            return
+        path = self._path(key)
+        payload = zlib.compress(
+            json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode()
+        )
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            previous = os.path.getsize(path)
+        except OSError:
+            previous = 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._entries())
+            else:
+                self._total_bytes += len(payload) - previous
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self) -> List[Tuple[int, int, str]]:
+        """(mtime_ns, size, path) of every stored response"""
+        entries = []
+        try:
+            buckets = os.scandir(self.directory)
+        except FileNotFoundError:
+            return entries
+        with buckets:
+            for bucket in buckets:
+                if not bucket.is_dir():
+                    continue
+                with os.scandir(bucket.path) as it:
+                    for entry in it:
+                        if entry.name.endswith(ENTRY_SUFFIX):
+                            st = entry.stat()
+                            entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        return entries
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * _EVICT_TO
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+        self._total_bytes = total
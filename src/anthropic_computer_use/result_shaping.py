@@ -0,0 +1,141 @@
+import re
+from typing import List, Tuple
+
+from .compaction import estimate_tokens
+
+# Per-result budget of estimated tokens; 0 disables truncation
+DEFAULT_RESULT_TOKENS = 10_000
+CHARS_PER_TOKEN = 4
+# A line must repeat this many times in a row to be collapsed
+MIN_REPEAT_RUN = 3
+
+# CSI (colors, cursor movement), OSC (titles, hyperlinks) and two-byte
+# escape sequences
+_ANSI = re.compile(
+    r"\x1b\[[0-?]*[ -/]*[@-~]"
+    r"|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)?"
+    r"|\x1b[@-Z\\-_]"
+)
+_OVERSTRIKE = re.compile(r"[^\x08\n]\x08")
+_CONTROL = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+
+FETCH_OUTPUT_HINT = (
+    "Narrow the command (grep, head, tail, sed -n 'START,ENDp', or write the "
+    "output to a file and view parts of it) to see the omitted part."
+)
+FETCH_VIEW_HINT = "Call view with a view_range to see the omitted lines."
+
+
+def strip_control(text: str) -> str:
+    """Remove terminal escape codes and resolve carriage-return redraws.
+
+    A line rewritten with \\r (progress bars, spinners) keeps only what was
+    drawn last, and backspace overstrikes (as in man pages) are undone.
+    """
+    if "\x1b" in text:
+        text = _ANSI.sub("", text)
+    if "\x08" in text:
+        previous = None
+        while previous != text:
+            previous, text = text, _OVERSTRIKE.sub("", text)
+    if "\r" in text:
+        text = text.replace("\r\n", "\n")
+        text = "\n".join(
+            _last_redraw(line) if "\r" in line else line for line in text.split("\n")
+        )
+    return _CONTROL.sub("", text)
+
+
+def _last_redraw(line: str) -> str:
+    parts = [part for part in line.split("\r") if part]
+    return parts[-1] if parts else ""
+
+
+def collapse_repeats(text: str, min_run: int = MIN_REPEAT_RUN) -> str:
+    """Replace runs of identical lines with one copy and a count"""
+    lines = text.split("\n")
+    if len(lines) < min_run:
+        return text
+    collapsed: List[str] = []
+    i = 0
+    while i < len(lines):
+        j = i + 1
+        while j < len(lines) and lines[j] == lines[i]:
+            j += 1
+        run = j - i
+        collapsed.append(lines[i])
+        if run >= min_run:
+            collapsed.append(f"[previous line repeated {run - 1} more times]")
+        else:
+            collapsed.extend(lines[i + 1 : j])
+        i = j
+    return "\n".join(collapsed)
+
+
+def truncate_middle(
+    text: str, budget_tokens: int, hint: str = "", head_fraction: float = 0.5
+) -> Tuple[str, int]:
+    """Keep the head and tail of `text` within `budget_tokens`
+
+    Cuts fall on line boundaries where one is near, so a single huge line
+    (minified JSON) is cut mid-line. Returns the text and the number of
+    characters omitted.
+    """
+    if budget_tokens <= 0 or estimate_tokens(text) <= budget_tokens:
+        return text, 0
+    max_chars = budget_tokens * CHARS_PER_TOKEN
+    head_chars = int(max_chars * head_fraction)
+    tail_chars = max_chars - head_chars
+
+    head = text[:head_chars]
+    newline = head.rfind("\n")
+    if newline >= head_chars // 2:
+        head = head[: newline + 1]
+    tail = text[len(text) - tail_chars :] if tail_chars else ""
+    newline = tail.find("\n")
+    if 0 <= newline <= tail_chars // 2:
+        tail = tail[newline + 1 :]
+
+    omitted = text[len(head) : len(text) - len(tail)]
+    omitted_lines = omitted.count("\n")
+    size = f"{len(omitted)} characters, ~{estimate_tokens(omitted)} tokens"
+    if omitted_lines:
+        what = f"{omitted_lines} lines ({size})"
+    else:
+        what = f"{size} of one line"
+    marker = f"[... {what} omitted.{' ' + hint if hint else ''}]"
+    if not head.endswith("\n"):
+        marker = "\n" + marker
+    if tail:
+        marker += "\n"
+    return head + marker + tail, len(omitted)
+
+
+def shape_output(
+    text: str, budget_tokens: int, hint: str = FETCH_OUTPUT_HINT
+) -> Tuple[str, int]:
+    """Clean up command output and fit it to the budget.
+
+    Returns the shaped text and the estimated tokens saved.
+    """
+    if not text:
+        return text, 0
+    before = estimate_tokens(text)
+    shaped = collapse_repeats(strip_control(text))
+    # The end of command output (errors, summaries) tends to matter most
+    shaped, _ = truncate_middle(shaped, budget_tokens, hint, head_fraction=0.4)
+    return shaped, max(0, before - estimate_tokens(shaped))
+
+
+def shape_view(
+    text: str, budget_tokens: int, hint: str = FETCH_VIEW_HINT
+) -> Tuple[str, int]:
+    """Fit a file view to the budget, leaving its content otherwise exact.
+
+    Edits must match the file byte for byte, so nothing is stripped.
+    """
+    if not text:
+        return text, 0
+    before = estimate_tokens(text)
+    shaped, _ = truncate_middle(text, budget_tokens, hint)
+    return shaped, max(0, before - estimate_tokens(shaped))
@@ -0,0 +1,328 @@
+import math
+import os
+import signal
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+# Parent cgroup to create shell cgroups in; defaults to this process's own.
+# Limits only apply where the parent delegates the memory/pids/cpu
+# controllers, e.g. a unit started with `systemd-run --user -p Delegate=yes`.
+CGROUP_PARENT_ENV = "ACU_CGROUP_PARENT"
+CPU_PERIOD_USEC = 100_000
+# Grace between SIGXCPU at the CPU limit and SIGKILL
+CPU_HARD_GRACE_SECONDS = 5
+# Capability needed to raise a hard rlimit again once it was lowered
+CAP_SYS_RESOURCE = 24
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+class ResourceLimits:
+    """Limits of a bash session's shell and its commands; None leaves one unset.
+
+    The rlimits are set on the shell once it starts and every command
+    inherits them. RLIMIT_CPU counts the CPU time a process has used since
+    it started, so the CPU limit is re-armed before each command at what
+    the shell has used so far plus `cpu_seconds`: a command gets that much
+    CPU time per process it starts (plus the little the shell itself has
+    used), and the shell's own total never runs out. The process count is
+    per user, as with `ulimit -u`, and root ignores it; a cgroup's pids.max
+    is per shell. `cpus` caps the CPU share of the whole shell and only
+    applies in a cgroup.
+    """
+
+    def __init__(
+        self,
+        cpu_seconds: Optional[int] = None,
+        memory_bytes: Optional[int] = None,
+        max_processes: Optional[int] = None,
+        file_size_bytes: Optional[int] = None,
+        cpus: Optional[float] = None,
+        nice: int = 0,
+        cgroup: bool = False,
+    ):
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = memory_bytes
+        self.max_processes = max_processes
+        self.file_size_bytes = file_size_bytes
+        self.cpus = cpus
+        self.nice = nice
+        self.cgroup = cgroup
+
+    @property
+    def enabled(self) -> bool:
+        return bool(
+            self.cpu_seconds
+            or self.memory_bytes
+            or self.max_processes
+            or self.file_size_bytes
+            or self.cpus
+            or self.nice
+            or self.cgroup
+        )
+
+    def _rlimits(self) -> List[Tuple[str, int, int]]:
+        """(name, RLIMIT_* constant, value) of the limits that are set"""
+        if resource is None:
+            return []
+        # The CPU limit is handled by rearm_cpu()
+        wanted = [
+            ("memory", "RLIMIT_AS", self.memory_bytes),
+            ("processes", "RLIMIT_NPROC", self.max_processes),
+            ("file_size", "RLIMIT_FSIZE", self.file_size_bytes),
+        ]
+        return [
+            (name, getattr(resource, constant), value)
+            for name, constant, value in wanted
+            if value and hasattr(resource, constant)
+        ]
+
+    def apply(self, pid: int) -> List[str]:
+        """Set the limits on a running process; return those that took effect"""
+        applied = []
+        for name, limit, value in self._rlimits():
+            if not hasattr(resource, "prlimit"):
+                break
+            try:
+                _, hard = resource.prlimit(pid, limit)
+                if hard != resource.RLIM_INFINITY:
+                    value = min(value, hard)
+                resource.prlimit(pid, limit, (value, value))
+                applied.append(name)
+            except (OSError, ValueError):
+                continue
+        if self.rearm_cpu(pid):
+            applied.append("cpu")
+        if self.nice:
+            try:
+                os.setpriority(os.PRIO_PROCESS, pid, self.nice)
+                applied.append("nice")
+            except (AttributeError, OSError):
+                pass
+        return applied
+
+    def rearm_cpu(self, pid: int) -> bool:
+        """Give the shell `cpu_seconds` of CPU time from now on
+
+        Past the soft limit a process gets SIGXCPU, which it may catch; the
+        hard limit a little later is a SIGKILL. Without CAP_SYS_RESOURCE a
+        lowered hard limit could not be raised for the next command, so
+        only the soft limit moves then.
+        """
+        if not self.cpu_seconds or resource is None:
+            return False
+        if not hasattr(resource, "prlimit") or not hasattr(resource, "RLIMIT_CPU"):
+            return False
+        used = own_cpu_seconds(pid)
+        if used is None:
+            return False
+        soft = math.ceil(used) + self.cpu_seconds
+        try:
+            _, hard = resource.prlimit(pid, resource.RLIMIT_CPU)
+            if _can_raise_hard_limits():
+                hard = soft + CPU_HARD_GRACE_SECONDS
+            elif hard != resource.RLIM_INFINITY:
+                soft = min(soft, hard)
+            resource.prlimit(pid, resource.RLIMIT_CPU, (soft, hard))
+        except (OSError, ValueError):
+            return False
+        return True
+
+    def ulimit_script(self) -> str:
+        """Shell commands setting the rlimits, for systems without prlimit()
+
+        The CPU limit cannot be re-armed there and is left out.
+        """
+        if resource is not None and hasattr(resource, "prlimit"):
+            return ""
+        options = [
+            ("-v", self.memory_bytes // 1024 if self.memory_bytes else None),
+            ("-u", self.max_processes),
+            ("-f", self.file_size_bytes // 1024 if self.file_size_bytes else None),
+        ]
+        return "".join(
+            f"ulimit -S -H {flag} {value} 2>/dev/null\n"
+            for flag, value in options
+            if value
+        )
+
+    def describe_exit(self, returncode: Optional[int]) -> Optional[str]:
+        """Explain an exit status caused by one of the limits, if it was"""
+        if returncode is None or returncode <= 128:
+            return None
+        signum = returncode - 128
+        if signum == getattr(signal, "SIGXCPU", None):
+            return f"The command hit its CPU time limit ({self.cpu_seconds}s)."
+        if signum == getattr(signal, "SIGXFSZ", None):
+            return f"The command hit its file size limit ({self.file_size_bytes} bytes)."
+        if signum == signal.SIGKILL and (self.cpu_seconds or self.memory_bytes):
+            return "The command was killed, possibly by its CPU time or memory limit."
+        return None
+
+
+class Cgroup:
+    """A cgroup v2 group holding one shell and everything it starts.
+
+    Created under the parent named by $ACU_CGROUP_PARENT, or under this
+    process's own cgroup. Memory, process and CPU limits are written where
+    the parent delegates those controllers; killing and CPU accounting work
+    in any cgroup v2 group.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.limits: List[str] = []
+
+    @classmethod
+    def create(cls, limits: ResourceLimits) -> Optional["Cgroup"]:
+        """Create a group for a shell, or return None without cgroup v2 access"""
+        parent = os.environ.get(CGROUP_PARENT_ENV) or _own_cgroup()
+        if parent is None:
+            return None
+        path = os.path.join(parent, f"acu-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        try:
+            os.mkdir(path)
+        except OSError:
+            return None
+        group = cls(path)
+        if limits.memory_bytes and group._write("memory.max", limits.memory_bytes):
+            group._write("memory.swap.max", 0)
+            group.limits.append("memory")
+        if limits.max_processes and group._write("pids.max", limits.max_processes):
+            group.limits.append("processes")
+        if limits.cpus and group._write(
+            "cpu.max", f"{int(limits.cpus * CPU_PERIOD_USEC)} {CPU_PERIOD_USEC}"
+        ):
+            group.limits.append("cpus")
+        return group
+
+    def _write(self, name: str, value) -> bool:
+        try:
+            with open(os.path.join(self.path, name), "w") as f:
+                f.write(str(value))
+            return True
+        except OSError:
+            return False
+
+    def add(self, pid: int) -> bool:
+        return self._write("cgroup.procs", pid)
+
+    def cpu_seconds(self) -> Optional[float]:
+        """Total CPU time used by the group so far"""
+        try:
+            with open(os.path.join(self.path, "cpu.stat")) as f:
+                for line in f:
+                    key, value = line.split()
+                    if key == "usage_usec":
+                        return int(value) / 1e6
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def kill(self) -> None:
+        """SIGKILL every process in the group, even those outside the process group"""
+        if self._write("cgroup.kill", 1):
+            return
+        try:
+            with open(os.path.join(self.path, "cgroup.procs")) as f:
+                pids = [int(line) for line in f if line.strip()]
+        except OSError:
+            return
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def remove(self) -> None:
+        # The kernel releases killed processes asynchronously
+        for _ in range(50):
+            try:
+                os.rmdir(self.path)
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                time.sleep(0.01)
+
+
+def _own_cgroup() -> Optional[str]:
+    """Directory of this process's cgroup, if it is on a cgroup v2 hierarchy"""
+    if not os.path.exists(os.path.join(CGROUP_ROOT, "cgroup.controllers")):
+        return None
+    try:
+        with open("/proc/self/cgroup") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    return os.path.join(CGROUP_ROOT, line[3:].strip().lstrip("/"))
+    except OSError:
+        pass
+    return None
+
+
+_capabilities: Optional[int] = None
+
+
+def _can_raise_hard_limits() -> bool:
+    global _capabilities
+    if _capabilities is None:
+        _capabilities = 0
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("CapEff:"):
+                        _capabilities = int(line.split()[1], 16)
+        except (OSError, ValueError):
+            pass
+    return bool(_capabilities & (1 << CAP_SYS_RESOURCE))
+
+
+def _cpu_ticks(pid: int) -> Optional[Tuple[int, int, int, int]]:
+    """utime, stime, cutime and cstime of a process, in clock ticks"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # Fields after the parenthesised command name; utime is field 14
+    fields = stat[stat.rindex(")") + 2 :].split()
+    try:
+        utime, stime, cutime, cstime = (int(value) for value in fields[11:15])
+    except (ValueError, IndexError):
+        return None
+    return utime, stime, cutime, cstime
+
+
+def own_cpu_seconds(pid: int) -> Optional[float]:
+    """CPU seconds a process has used itself, as RLIMIT_CPU counts them"""
+    ticks = _cpu_ticks(pid)
+    if ticks is None:
+        return None
+    return (ticks[0] + ticks[1]) / _CLOCK_TICKS
+
+
+def process_cpu_seconds(pid: int) -> Optional[Tuple[float, float]]:
+    """User and system CPU seconds of a process and its waited-for children"""
+    ticks = _cpu_ticks(pid)
+    if ticks is None:
+        return None
+    utime, stime, cutime, cstime = ticks
+    return (utime + cutime) / _CLOCK_TICKS, (stime + cstime) / _CLOCK_TICKS
+
+
+def usage_delta(
+    before: Optional[Tuple[float, float]], after: Optional[Tuple[float, float]]
+) -> Optional[Dict[str, float]]:
+    if before is None or after is None:
+        return None
+    return {
+        "cpu_user_seconds": round(after[0] - before[0], 3),
+        "cpu_system_seconds": round(after[1] - before[1], 3),
+    }
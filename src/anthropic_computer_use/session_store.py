@@ -0,0 +1,183 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List
+
+_SCHEMA_VERSION = 1
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    mode TEXT NOT NULL,
+    prompt TEXT,
+    status TEXT NOT NULL,
+    turns INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+"""
+
+
+class SessionNotFound(Exception):
+    """Raised when resuming a session the store does not know"""
+
+
+class SessionStore:
+    """Append-only SQLite store of session conversations.
+
+    Every message is written as its own row the moment it joins the
+    conversation, so a crashed session loses at most the turn in flight.
+    The database runs in WAL mode with synchronous=NORMAL, so a turn's
+    write is an append to the log without an fsync of its own. One
+    connection is shared by all sessions of the process behind a lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("PRAGMA foreign_keys=ON")
+            version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+            if version < _SCHEMA_VERSION:
+                self._connection.executescript(_SCHEMA)
+                self._connection.execute(f"PRAGMA user_version={_SCHEMA_VERSION}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def create_session(self, session_id: str, mode: str, prompt: str) -> None:
+        """Register a session, replacing any conversation stored under its id"""
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM messages WHERE session_id = ?", (session_id,)
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO sessions "
+                "(id, mode, prompt, status, turns, created, updated) "
+                "VALUES (?, ?, ?, 'running', 0, ?, ?)",
+                (session_id, mode, prompt, now, now),
+            )
+
+    def append_message(
+        self, session_id: str, seq: int, message: Dict[str, Any]
+    ) -> None:
+        """Persist message number `seq` of a conversation"""
+        now = time.time()
+        assistant = 1 if message["role"] == "assistant" else 0
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO messages "
+                "(session_id, seq, role, content, created) VALUES (?, ?, ?, ?, ?)",
+                (
+                    session_id,
+                    seq,
+                    message["role"],
+                    json.dumps(message["content"], separators=(",", ":")),
+                    now,
+                ),
+            )
+            self._connection.execute(
+                "UPDATE sessions SET updated = ?, turns = turns + ? WHERE id = ?",
+                (now, assistant, session_id),
+            )
+
+    def set_status(self, session_id: str, status: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE sessions SET status = ?, updated = ? WHERE id = ?",
+                (status, time.time(), session_id),
+            )
+
+    def get_session(self, session_id: str) -> Dict[str, Any]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT * FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            raise SessionNotFound(f"No stored session {session_id}")
+        return dict(row)
+
+    def load_messages(self, session_id: str) -> List[Dict[str, Any]]:
+        """The stored conversation of a session, in order"""
+        self.get_session(session_id)
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY seq",
+                (session_id,),
+            ).fetchall()
+        return [{"role": row[0], "content": json.loads(row[1])} for row in rows]
+
+    def list_sessions(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recently updated sessions first"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT * FROM sessions ORDER BY updated DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def prune(self, older_than_days: float) -> List[str]:
+        """Delete sessions not updated in `older_than_days`; return their ids"""
+        cutoff = time.time() - older_than_days * 86400
+        with self._lock, self._connection:
+            ids = [
+                row[0]
+                for row in self._connection.execute(
+                    "SELECT id FROM sessions WHERE updated < ?", (cutoff,)
+                )
+            ]
+            self._connection.executemany(
+                "DELETE FROM sessions WHERE id = ?", [(i,) for i in ids]
+            )
+        return ids
+
+
+def repair_conversation(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Make an interrupted conversation valid to continue.
+
+    A trailing assistant turn whose tool calls never got results is kept
+    (regenerating it would cost a turn) and answered with error results
+    saying the calls were interrupted, without re-running them.
+    """
+    if not messages or messages[-1]["role"] != "assistant":
+        return messages
+    pending = [
+        block["id"]
+        for block in messages[-1]["content"]
+        if isinstance(block, dict) and block.get("type") == "tool_use"
+    ]
+    if not pending:
+        return messages
+    results = [
+        {
+            "type": "tool_result",
+            "tool_use_id": tool_use_id,
+            "content": [
+                {
+                    "type": "text",
+                    "text": "The session was interrupted before this tool call "
+                    "completed; its effects are unknown. Check the state and "
+                    "run it again if needed.",
+                }
+            ],
+            "is_error": True,
+        }
+        for tool_use_id in pending
+    ]
+    return messages + [{"role": "user", "content": results}]
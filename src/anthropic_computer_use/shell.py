@@ -0,0 +1,361 @@
+import os
+import selectors
+import shlex
+import signal
+import subprocess
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from .sandbox import Cgroup, ResourceLimits, process_cpu_seconds, usage_delta
+
+DEFAULT_TIMEOUT = 120.0
+DEFAULT_MAX_OUTPUT_BYTES = 64 * 1024 * 1024
+DEFAULT_HEAD_BYTES = 32 * 1024
+DEFAULT_TAIL_BYTES = 32 * 1024
+# How long a pipe at EOF waits for bash to exit before it counts as closed
+EXIT_GRACE_SECONDS = 0.1
+# The shell keeps its pipes on these descriptors for the framing, so a
+# command that redirects its own stdout or stderr (`exec >out.log`) does not
+# redirect the sentinels too. Commands run with them closed.
+FRAME_STDOUT_FD = 198
+FRAME_STDERR_FD = 199
+
+
+class ShellExited(Exception):
+    """Raised when the bash process exits while a command is running"""
+
+
+class OutputCapture:
+    """Bounded head+tail capture of a byte stream.
+
+    The first `head_bytes` are kept verbatim, then only the last
+    `tail_bytes` are retained; everything in between is counted in
+    `dropped_bytes` so memory stays flat regardless of output size.
+    """
+
+    def __init__(
+        self, head_bytes: int = DEFAULT_HEAD_BYTES, tail_bytes: int = DEFAULT_TAIL_BYTES
+    ):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total_bytes = 0
+
+    @property
+    def dropped_bytes(self) -> int:
+        return self.total_bytes - len(self.head) - len(self.tail)
+
+    def feed(self, data: bytes) -> None:
+        """Append a chunk of output"""
+        self.total_bytes += len(data)
+        room = self.head_bytes - len(self.head)
+        if room > 0:
+            self.head.extend(data[:room])
+            data = data[room:]
+        if not data or self.tail_bytes <= 0:
+            return
+        self.tail.extend(data[-self.tail_bytes :])
+        excess = len(self.tail) - self.tail_bytes
+        if excess > 0:
+            del self.tail[:excess]
+
+    def text(self) -> str:
+        """Decode the captured output, marking any omitted middle section"""
+        head = self.head.decode(errors="replace")
+        tail = self.tail.decode(errors="replace")
+        if self.dropped_bytes:
+            return f"{head}\n[... {self.dropped_bytes} bytes omitted ...]\n{tail}"
+        return head + tail
+
+
+class _FramedReader:
+    """Feeds a pipe into an OutputCapture until the sentinel line is seen.
+
+    A short window is held back before being committed so that a sentinel
+    split across reads is still recognised and never leaks into the capture.
+    """
+
+    def __init__(self, marker: bytes, capture: OutputCapture):
+        self.marker = marker
+        self.capture = capture
+        self.pending = bytearray()
+        self.status = bytearray()
+        self.found = False
+        self.done = False
+
+    def feed(self, chunk: bytes) -> None:
+        if self.found:
+            self.status.extend(chunk)
+        else:
+            self.pending.extend(chunk)
+            index = self.pending.find(self.marker)
+            if index >= 0:
+                self.capture.feed(bytes(self.pending[:index]))
+                self.status.extend(self.pending[index + len(self.marker) :])
+                self.pending.clear()
+                self.found = True
+            else:
+                keep = len(self.marker) - 1
+                if len(self.pending) > keep:
+                    self.capture.feed(bytes(self.pending[:-keep]))
+                    del self.pending[:-keep]
+        if self.found and b"\n" in self.status:
+            self.done = True
+
+    def flush(self) -> None:
+        """Commit whatever was held back (used when the command is aborted)"""
+        self.capture.feed(bytes(self.pending))
+        self.pending.clear()
+
+    def close(self) -> None:
+        """The shell closed this pipe (e.g. `exec 2>/dev/null`); stop waiting"""
+        self.flush()
+        self.done = True
+
+    def returncode(self) -> Optional[int]:
+        try:
+            return int(self.status.strip())
+        except ValueError:
+            return None
+
+
+class ShellResult:
+    def __init__(
+        self,
+        stdout: str,
+        stderr: str,
+        returncode: Optional[int],
+        timed_out: bool = False,
+        output_limited: bool = False,
+        dropped_bytes: int = 0,
+        usage: Optional[Dict[str, float]] = None,
+    ):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = returncode
+        self.timed_out = timed_out
+        self.output_limited = output_limited
+        self.dropped_bytes = dropped_bytes
+        self.usage = usage
+
+
+class ShellProcess:
+    """A long-lived bash process driven over pipes.
+
+    Each command is sent to the same bash child and framed by a random
+    sentinel that is echoed to stdout (with the exit status) and to stderr
+    once the command finishes, so `cd`, shell variables, functions and
+    activated virtualenvs persist between calls.
+
+    With `limits`, the shell is started under rlimits (and, when asked and
+    available, in its own cgroup v2 group) that every command inherits, so
+    a runaway command cannot take the host down with it.
+    """
+
+    def __init__(
+        self,
+        env: Optional[Dict[str, str]] = None,
+        cwd: Optional[str] = None,
+        executable: str = "/bin/bash",
+        timeout: Optional[float] = DEFAULT_TIMEOUT,
+        max_output_bytes: Optional[int] = DEFAULT_MAX_OUTPUT_BYTES,
+        head_bytes: int = DEFAULT_HEAD_BYTES,
+        tail_bytes: int = DEFAULT_TAIL_BYTES,
+        limits: Optional[ResourceLimits] = None,
+    ):
+        self.env = env if env is not None else os.environ.copy()
+        self.cwd = cwd
+        self.executable = executable
+        self.timeout = timeout
+        self.max_output_bytes = max_output_bytes
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.limits = limits if limits is not None and limits.enabled else None
+        # Limits that took effect on the current shell
+        self.applied_limits: List[str] = []
+        self.cgroup: Optional[Cgroup] = None
+        self._process: Optional[subprocess.Popen] = None
+        # Pipes the shell closed by redirecting its own stdout or stderr
+        self._closed_streams: set = set()
+
+    @property
+    def running(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def start(self) -> None:
+        """Spawn the bash child in its own process group"""
+        self._process = subprocess.Popen(
+            [self.executable, "--noprofile", "--norc"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=self.env,
+            cwd=self.cwd,
+            start_new_session=True,
+        )
+        self._closed_streams = set()
+        self._process.stdin.write(
+            f"exec {FRAME_STDOUT_FD}>&1 {FRAME_STDERR_FD}>&2\n".encode()
+        )
+        self._process.stdin.flush()
+        if self.limits is not None:
+            self._confine(self._process.pid)
+
+    def _confine(self, pid: int) -> None:
+        """Apply the limits to a new shell before it runs anything"""
+        self.applied_limits = self.limits.apply(pid)
+        script = self.limits.ulimit_script()
+        if script:
+            self._process.stdin.write(script.encode())
+            self._process.stdin.flush()
+            self.applied_limits.append("ulimit")
+        if self.limits.cgroup:
+            self.cgroup = Cgroup.create(self.limits)
+            if self.cgroup is not None and self.cgroup.add(pid):
+                self.applied_limits.extend(["cgroup"] + self.cgroup.limits)
+            elif self.cgroup is not None:
+                self.cgroup.remove()
+                self.cgroup = None
+
+    def stop(self) -> None:
+        """Kill the bash child and everything it started"""
+        process = self._process
+        self._process = None
+        if process is None:
+            return
+        if self.cgroup is not None:
+            self.cgroup.kill()
+        if process.poll() is None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        process.wait()
+        for stream in (process.stdin, process.stdout, process.stderr):
+            if stream:
+                stream.close()
+        if self.cgroup is not None:
+            self.cgroup.remove()
+            self.cgroup = None
+
+    @staticmethod
+    def _exited(process: subprocess.Popen) -> bool:
+        """Whether bash exited, rather than just closing one of its pipes"""
+        try:
+            process.wait(EXIT_GRACE_SECONDS)
+            return True
+        except subprocess.TimeoutExpired:
+            return False
+
+    def restart(self) -> None:
+        """Kill the current bash child and spawn a fresh one"""
+        self.stop()
+        self.start()
+
+    def run(self, command: str, timeout: Optional[float] = None) -> ShellResult:
+        """Run a command in the persistent shell and stream its output.
+
+        Output is read incrementally into bounded captures. If the command
+        exceeds its wall-clock timeout or `max_output_bytes`, the whole
+        process group is killed and the shell is respawned on the next call.
+        """
+        if not self.running:
+            self.stop()
+            self.start()
+
+        timeout = self.timeout if timeout is None else timeout
+        process = self._process
+        if self.limits is not None and "cpu" in self.applied_limits:
+            self.limits.rearm_cpu(process.pid)
+        cpu_before = process_cpu_seconds(process.pid)
+        group_cpu_before = self.cgroup.cpu_seconds() if self.cgroup else None
+        sentinel = f"__ACU_DONE_{uuid.uuid4().hex}__"
+        # eval keeps syntax errors from killing the shell; stdin is detached so
+        # commands cannot swallow the framing of the next command.
+        closed = f"{FRAME_STDOUT_FD}>&- {FRAME_STDERR_FD}>&-"
+        script = (
+            f"eval {shlex.quote(command)} < /dev/null {closed}\n"
+            f"printf '\\n{sentinel}%d\\n' $? >&{FRAME_STDOUT_FD}\n"
+            f"printf '\\n{sentinel}\\n' >&{FRAME_STDERR_FD}\n"
+        )
+        process.stdin.write(script.encode())
+        process.stdin.flush()
+
+        marker = f"\n{sentinel}".encode()
+        readers = {
+            process.stdout: _FramedReader(
+                marker, OutputCapture(self.head_bytes, self.tail_bytes)
+            ),
+            process.stderr: _FramedReader(
+                marker, OutputCapture(self.head_bytes, self.tail_bytes)
+            ),
+        }
+        deadline = time.monotonic() + timeout if timeout else None
+        timed_out = output_limited = False
+
+        for stream, reader in readers.items():
+            if stream in self._closed_streams:
+                reader.close()
+
+        with selectors.DefaultSelector() as selector:
+            for stream, reader in readers.items():
+                if not reader.done:
+                    selector.register(stream, selectors.EVENT_READ)
+            while not all(reader.done for reader in readers.values()):
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        timed_out = True
+                        break
+                for key, _ in selector.select(remaining):
+                    stream = key.fileobj
+                    chunk = os.read(stream.fileno(), 65536)
+                    reader = readers[stream]
+                    if not chunk:
+                        if self._exited(process):
+                            self.stop()
+                            raise ShellExited("Bash process exited")
+                        self._closed_streams.add(stream)
+                        selector.unregister(stream)
+                        reader.close()
+                        continue
+                    reader.feed(chunk)
+                    if reader.done:
+                        selector.unregister(stream)
+                total = sum(r.capture.total_bytes for r in readers.values())
+                if self.max_output_bytes and total > self.max_output_bytes:
+                    output_limited = True
+                    break
+
+        stdout_reader = readers[process.stdout]
+        stderr_reader = readers[process.stderr]
+        returncode = None
+        usage = None
+        if timed_out or output_limited:
+            # Only the cgroup still accounts for the processes being killed
+            if group_cpu_before is not None:
+                group_cpu = self.cgroup.cpu_seconds()
+                if group_cpu is not None:
+                    usage = {"cpu_seconds": round(group_cpu - group_cpu_before, 3)}
+            self.stop()
+            stdout_reader.flush()
+            stderr_reader.flush()
+        else:
+            returncode = stdout_reader.returncode()
+            # The shell has waited for the command, so its children's CPU
+            # time now includes it
+            usage = usage_delta(cpu_before, process_cpu_seconds(process.pid))
+
+        return ShellResult(
+            stdout_reader.capture.text(),
+            stderr_reader.capture.text(),
+            returncode,
+            timed_out=timed_out,
+            output_limited=output_limited,
+            dropped_bytes=stdout_reader.capture.dropped_bytes
+            + stderr_reader.capture.dropped_bytes,
+            usage=usage,
+        )
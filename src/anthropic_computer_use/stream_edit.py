@@ -0,0 +1,120 @@
+import os
+import shutil
+import stat
+import tempfile
+from typing import BinaryIO, Optional, Tuple
+
+CHUNK_BYTES = 1024 * 1024
+
+
+def find_occurrences(
+    path: str, needle: bytes, limit: int = 2
+) -> Tuple[int, Optional[int]]:
+    """Count occurrences of `needle`, stopping once `limit` are found.
+
+    Reads the file in chunks that overlap by len(needle) - 1 bytes, so
+    memory use does not depend on file size. Returns (count, first offset).
+    """
+    if not needle:
+        raise ValueError("needle must not be empty")
+    count = 0
+    first = None
+    overlap = len(needle) - 1
+    with open(path, "rb") as f:
+        carry = b""
+        base = 0  # file offset of carry[0]
+        while count < limit:
+            chunk = f.read(CHUNK_BYTES)
+            if not chunk:
+                break
+            window = carry + chunk
+            start = 0
+            while count < limit:
+                index = window.find(needle, start)
+                if index < 0:
+                    break
+                if first is None:
+                    first = base + index
+                count += 1
+                start = index + len(needle)
+            # Keep the tail that could begin a match spanning the next chunk,
+            # but never re-scan bytes already consumed by a match.
+            keep_from = max(len(window) - overlap, start)
+            base += keep_from
+            carry = window[keep_from:]
+    return count, first
+
+
+def _copy_range(src: BinaryIO, dst: BinaryIO, length: int) -> None:
+    while length > 0:
+        chunk = src.read(min(CHUNK_BYTES, length))
+        if not chunk:
+            break
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+def splice(path: str, offset: int, remove: int, insert: bytes) -> None:
+    """Replace `remove` bytes at `offset` with `insert` via a temp file.
+
+    The file is copied in chunks into a temp file in the same directory,
+    which then replaces the original, so peak memory is one chunk and a
+    crash never leaves a half-written file behind. A symlink is written
+    through rather than replaced.
+    """
+    path = os.path.realpath(path)
+    mode = stat.S_IMODE(os.stat(path).st_mode)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path),
+        prefix=f".{os.path.basename(path)}.",
+        suffix=".tmp",
+    )
+    try:
+        with open(path, "rb") as src, os.fdopen(fd, "wb") as dst:
+            _copy_range(src, dst, offset)
+            dst.write(insert)
+            src.seek(offset + remove)
+            shutil.copyfileobj(src, dst, CHUNK_BYTES)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def line_start_offset(path: str, line: int) -> Tuple[Optional[int], bool]:
+    """Byte offset just after the first `line` lines of a file.
+
+    Returns (offset, needs_newline); offset is None when the file has fewer
+    than `line` lines. needs_newline is True when inserting at the end of a
+    file whose last line has no trailing newline.
+    """
+    if line == 0:
+        return 0, False
+    seen = 0
+    position = 0
+    last_byte = b""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_BYTES)
+            if not chunk:
+                break
+            index = -1
+            while True:
+                index = chunk.find(b"\n", index + 1)
+                if index < 0:
+                    break
+                seen += 1
+                if seen == line:
+                    return position + index + 1, False
+            position += len(chunk)
+            last_byte = chunk[-1:]
+    # An unterminated last line still counts as a line
+    if last_byte and last_byte != b"\n" and seen + 1 == line:
+        return position, True
+    return None, False
@@ -0,0 +1,58 @@
+import json
+from typing import Any, Callable, Dict, List, Optional
+
+from anthropic.types.beta import BetaMessage, BetaToolUseBlock
+
+
+class StreamAccumulator:
+    """Rebuilds a BetaMessage from raw stream events.
+
+    `on_text` receives text deltas as they arrive and `on_tool_use` receives
+    each tool_use block as soon as its input JSON is complete, before the
+    rest of the response has been generated.
+    """
+
+    def __init__(
+        self,
+        on_text: Optional[Callable[[str], None]] = None,
+        on_tool_use: Optional[Callable[[BetaToolUseBlock], None]] = None,
+    ):
+        self.on_text = on_text
+        self.on_tool_use = on_tool_use
+        self._message: Dict[str, Any] = {}
+        self._blocks: Dict[int, Dict[str, Any]] = {}
+        self._partial_json: Dict[int, List[str]] = {}
+
+    def feed(self, event: Any) -> None:
+        if event.type == "message_start":
+            self._message = event.message.model_dump()
+            self._message["content"] = []
+        elif event.type == "content_block_start":
+            self._blocks[event.index] = event.content_block.model_dump()
+            self._partial_json[event.index] = []
+        elif event.type == "content_block_delta":
+            block = self._blocks[event.index]
+            if event.delta.type == "text_delta":
+                block["text"] = block.get("text", "") + event.delta.text
+                if self.on_text:
+                    self.on_text(event.delta.text)
+            elif event.delta.type == "input_json_delta":
+                self._partial_json[event.index].append(event.delta.partial_json)
+        elif event.type == "content_block_stop":
+            block = self._blocks[event.index]
+            if block["type"] == "tool_use":
+                raw = "".join(self._partial_json[event.index])
+                block["input"] = json.loads(raw) if raw else {}
+                if self.on_tool_use:
+                    self.on_tool_use(BetaToolUseBlock.model_validate(block))
+        elif event.type == "message_delta":
+            self._message["stop_reason"] = event.delta.stop_reason
+            self._message["stop_sequence"] = event.delta.stop_sequence
+            self._message["usage"]["output_tokens"] = event.usage.output_tokens
+
+    def message(self) -> BetaMessage:
+        """Return the assembled message once the stream is exhausted"""
+        self._message["content"] = [
+            self._blocks[index] for index in sorted(self._blocks)
+        ]
+        return BetaMessage.model_validate(self._message)
@@ -0,0 +1,179 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import IO, Any, Dict, Iterable, List, Optional
+
+DEFAULT_PAYLOAD_CHARS = 2000
+DEFAULT_CONSOLE_PAYLOAD_CHARS = 500
+
+# High-volume events that are subject to sampling
+SAMPLED_EVENTS = frozenset({"api_response", "tool_call", "tool_output"})
+
+HUMAN_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(prefix)s - %(message)s"
+
+_listeners: Dict[str, QueueListener] = {}
+_listeners_lock = threading.Lock()
+
+
+def truncate(value: Any, max_chars: int) -> Any:
+    """Recursively shorten strings in a payload to at most max_chars"""
+    if hasattr(value, "model_dump"):
+        value = value.model_dump()
+    if isinstance(value, str):
+        if max_chars and len(value) > max_chars:
+            omitted = len(value) - max_chars
+            return f"{value[:max_chars]}...[truncated {omitted} chars]"
+        return value
+    if isinstance(value, dict):
+        return {key: truncate(item, max_chars) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [truncate(item, max_chars) for item in value]
+    return value
+
+
+class SessionLogAdapter(logging.LoggerAdapter):
+    """LoggerAdapter that merges per-call `extra` with the adapter's own.
+
+    `event` logs a named structured event whose keyword fields are only
+    serialised by the listener thread, off the agent loop.
+    """
+
+    def process(self, msg, kwargs):
+        kwargs["extra"] = {**self.extra, **kwargs.get("extra", {})}
+        return msg, kwargs
+
+    def event(
+        self, event: str, message: str, level: int = logging.INFO, **fields: Any
+    ) -> None:
+        self.log(level, message, extra={"event": event, "fields": fields})
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only `rate` of the high-volume payload events"""
+
+    def __init__(self, rate: float, events: Iterable[str] = SAMPLED_EVENTS):
+        super().__init__()
+        self.rate = rate
+        self.events = frozenset(events)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1.0 or getattr(record, "event", None) not in self.events:
+            return True
+        return random.random() < self.rate
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that enqueues records untouched.
+
+    The stock handler formats every record before enqueueing it; here all
+    formatting happens in the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonlFormatter(logging.Formatter):
+    """One JSON object per record, with payload strings truncated"""
+
+    def __init__(self, max_payload_chars: int = DEFAULT_PAYLOAD_CHARS):
+        super().__init__()
+        self.max_payload_chars = max_payload_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": record.created,
+            "level": record.levelname,
+            "session": record.name,
+            "prefix": getattr(record, "prefix", None),
+            "event": getattr(record, "event", "log"),
+            "message": truncate(record.getMessage(), self.max_payload_chars),
+        }
+        for key, value in getattr(record, "fields", {}).items():
+            data[key] = truncate(value, self.max_payload_chars)
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class HumanFormatter(logging.Formatter):
+    """The console format, with a short rendering of any event fields"""
+
+    def __init__(self, max_payload_chars: int = DEFAULT_CONSOLE_PAYLOAD_CHARS):
+        super().__init__(HUMAN_FORMAT, defaults={"prefix": ""})
+        self.max_payload_chars = max_payload_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            rendered = json.dumps(truncate(fields, 0), default=str, ensure_ascii=False)
+            if len(rendered) > self.max_payload_chars:
+                rendered = rendered[: self.max_payload_chars] + "..."
+            text = f"{text} {rendered}"
+        return text
+
+
+def setup_session_logging(
+    name: str,
+    log_file: str,
+    max_payload_chars: int = DEFAULT_PAYLOAD_CHARS,
+    sample_rate: float = 1.0,
+    console: bool = True,
+    console_stream: Optional[IO[str]] = None,
+) -> logging.Logger:
+    """Attach a queue-backed JSONL file + console pipeline to a logger.
+
+    Calling it again for the same logger name reuses the running pipeline
+    instead of stacking more handlers.
+    """
+    logger = logging.getLogger(name)
+    with _listeners_lock:
+        if name in _listeners:
+            return logger
+
+        file_handler = RotatingFileHandler(
+            log_file, maxBytes=10 * 1024 * 1024, backupCount=5
+        )
+        file_handler.setFormatter(JsonlFormatter(max_payload_chars))
+        handlers: List[logging.Handler] = [file_handler]
+        if console:
+            console_handler = logging.StreamHandler(console_stream)
+            console_handler.setFormatter(HumanFormatter())
+            handlers.append(console_handler)
+
+        log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        queue_handler = DeferredQueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter(sample_rate))
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+
+        logger.addHandler(queue_handler)
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        _listeners[name] = listener
+    return logger
+
+
+def shutdown_session_logging(name: Optional[str] = None) -> None:
+    """Flush and stop one logging pipeline, or all of them"""
+    with _listeners_lock:
+        names = [name] if name is not None else list(_listeners)
+        for key in names:
+            listener = _listeners.pop(key, None)
+            if listener is None:
+                continue
+            listener.stop()
+            logger = logging.getLogger(key)
+            for handler in list(logger.handlers):
+                if isinstance(handler, DeferredQueueHandler):
+                    logger.removeHandler(handler)
+            for handler in listener.handlers:
+                handler.close()
+
+
+atexit.register(shutdown_session_logging)
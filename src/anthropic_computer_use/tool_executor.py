@@ -0,0 +1,74 @@
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+
+class ToolBatch:
+    """Tool calls from a single assistant response.
+
+    Calls are submitted in response order. Calls sharing a key are ordered
+    like a reader/writer lock: a write waits for everything submitted
+    before it on that key, a read only waits for the previous write.
+    Calls with no key, or on different keys, run concurrently.
+    """
+
+    def __init__(self, pool: ThreadPoolExecutor):
+        self._pool = pool
+        self._last_write: Dict[Hashable, Future] = {}
+        self._reads_since_write: Dict[Hashable, List[Future]] = {}
+        self.futures: List[Future] = []
+
+    def submit(
+        self,
+        fn: Callable[..., Any],
+        *args: Any,
+        key: Optional[Hashable] = None,
+        readonly: bool = False,
+    ) -> Future:
+        """Schedule a tool call behind the earlier calls it conflicts with"""
+        deps: List[Future] = []
+        if key is not None:
+            if key in self._last_write:
+                deps.append(self._last_write[key])
+            if not readonly:
+                deps.extend(self._reads_since_write.get(key, []))
+
+        def run() -> Any:
+            # Dependencies were submitted earlier, so with a FIFO pool they are
+            # already running or done by the time this blocks on them.
+            if deps:
+                wait(deps)
+            return fn(*args)
+
+        future = self._pool.submit(run)
+        if key is not None:
+            if readonly:
+                self._reads_since_write.setdefault(key, []).append(future)
+            else:
+                self._last_write[key] = future
+                self._reads_since_write[key] = []
+        self.futures.append(future)
+        return future
+
+    def results(self) -> List[Any]:
+        """Wait for every submitted call and return results in submit order"""
+        return [future.result() for future in self.futures]
+
+
+class ToolExecutor:
+    """Thread pool shared by all tool batches of a session"""
+
+    def __init__(self, max_workers: int = 8):
+        self.max_workers = max_workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def batch(self) -> ToolBatch:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="tool"
+            )
+        return ToolBatch(self._pool)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
@@ -0,0 +1,193 @@
+import fnmatch
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_EXCLUDES = ("__pycache__", "node_modules", "*.pyc")
+
+# (name, is_dir) pairs of a directory, sorted by name
+Entries = List[Tuple[str, bool]]
+
+
+class IgnoreRule:
+    """One .gitignore pattern, anchored to the directory that declared it"""
+
+    def __init__(self, base: str, pattern: str):
+        self.base = base
+        self._prefix = os.path.join(base, "")
+        self.negate = pattern.startswith("!")
+        if self.negate:
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        self.anchored = "/" in pattern
+        self.pattern = pattern.lstrip("/")
+
+    def matches(self, path: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        if not path.startswith(self._prefix):
+            return False
+        if self.anchored:
+            return fnmatch.fnmatchcase(path[len(self._prefix) :], self.pattern)
+        return fnmatch.fnmatchcase(os.path.basename(path), self.pattern)
+
+
+def parse_gitignore(path: str) -> List[IgnoreRule]:
+    base = os.path.dirname(path)
+    rules = []
+    with open(path, "r", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                rules.append(IgnoreRule(base, line))
+    return rules
+
+
+def is_ignored(rules: List[IgnoreRule], path: str, is_dir: bool) -> bool:
+    """Later rules win, as in git"""
+    ignored = False
+    for rule in rules:
+        if rule.matches(path, is_dir):
+            ignored = not rule.negate
+    return ignored
+
+
+class TreeIndex:
+    """In-process index of directory listings for fast directory views.
+
+    Each directory's entries are cached with the directory's mtime_ns and
+    rescanned with os.scandir only when that mtime changes, so repeat views
+    of a large tree cost one stat per visited directory. Hidden entries,
+    DEFAULT_EXCLUDES and .gitignore patterns are left out.
+    """
+
+    def __init__(self, root: str, excludes: Tuple[str, ...] = DEFAULT_EXCLUDES):
+        self.root = os.path.normpath(root)
+        self.excludes = excludes
+        self.scans = 0
+        self._dirs: Dict[str, Tuple[int, Entries]] = {}
+        self._ignores: Dict[str, Tuple[int, List[IgnoreRule]]] = {}
+        self._visible: Dict[str, Tuple[Entries, Tuple[IgnoreRule, ...], Entries]] = {}
+        self._lock = threading.Lock()
+
+    def _entries(self, directory: str) -> Entries:
+        mtime = os.stat(directory).st_mtime_ns
+        with self._lock:
+            cached = self._dirs.get(directory)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+
+        entries = []
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                entries.append((entry.name, is_dir))
+        entries.sort()
+        with self._lock:
+            self._dirs[directory] = (mtime, entries)
+            self.scans += 1
+        return entries
+
+    def _visible_entries(self, directory: str, rules: List[IgnoreRule]) -> Entries:
+        """Entries left after excludes and ignore rules, cached per listing"""
+        entries = self._entries(directory)
+        key = tuple(rules)
+        with self._lock:
+            cached = self._visible.get(directory)
+            if cached is not None and cached[0] is entries and cached[1] == key:
+                return cached[2]
+
+        visible = []
+        for name, is_dir in entries:
+            if self._excluded(name):
+                continue
+            if rules and is_ignored(rules, os.path.join(directory, name), is_dir):
+                continue
+            visible.append((name, is_dir))
+        with self._lock:
+            self._visible[directory] = (entries, key, visible)
+        return visible
+
+    def _gitignore_rules(self, directory: str) -> List[IgnoreRule]:
+        path = os.path.join(directory, ".gitignore")
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return []
+        with self._lock:
+            cached = self._ignores.get(path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+        rules = parse_gitignore(path)
+        with self._lock:
+            self._ignores[path] = (mtime, rules)
+        return rules
+
+    def _inherited_rules(self, directory: str) -> List[IgnoreRule]:
+        """Rules from .gitignore files between the index root and `directory`"""
+        rules: List[IgnoreRule] = []
+        relative = os.path.relpath(directory, self.root)
+        if relative.startswith(".."):
+            return rules
+        current = self.root
+        rules.extend(self._gitignore_rules(current))
+        if relative != ".":
+            for part in relative.split(os.sep)[:-1]:
+                current = os.path.join(current, part)
+                rules.extend(self._gitignore_rules(current))
+        return rules
+
+    def _excluded(self, name: str) -> bool:
+        if name.startswith(".") or name in self.excludes:
+            return True
+        return any(fnmatch.fnmatchcase(name, pattern) for pattern in self.excludes)
+
+    def listing(
+        self, directory: str, max_depth: int = 2, max_entries: int = 400
+    ) -> Tuple[List[str], int]:
+        """Return (relative paths, number of entries left out by max_entries)
+
+        Directories are listed with a trailing slash, at most `max_depth`
+        levels deep. Shallower entries are kept first when the listing has
+        to be cut, and the result is sorted by path.
+        """
+        directory = os.path.normpath(directory)
+        lines: List[str] = []
+        omitted = 0
+        stack: List[Tuple[str, str, int, List[IgnoreRule]]] = [
+            (directory, "", 1, self._inherited_rules(directory))
+        ]
+        while stack:
+            current, prefix, depth, rules = stack.pop()
+            rules = rules + self._gitignore_rules(current)
+            children: List[Tuple[str, str, int, List[IgnoreRule]]] = []
+            visible = self._visible_entries(current, rules)
+            room = max_entries - len(lines)
+            if len(visible) > room:
+                omitted += len(visible) - room
+                visible = visible[:room]
+            for name, is_dir in visible:
+                relative = prefix + name
+                if is_dir:
+                    lines.append(relative + "/")
+                    if depth < max_depth:
+                        path = os.path.join(current, name)
+                        children.append((path, relative + "/", depth + 1, rules))
+                else:
+                    lines.append(relative)
+            stack.extend(reversed(children))
+        lines.sort()
+        return lines, omitted
+
+    def invalidate(self, directory: Optional[str] = None) -> None:
+        with self._lock:
+            if directory is None:
+                self._dirs.clear()
+                self._visible.clear()
+            else:
+                self._dirs.pop(directory, None)
+                self._visible.pop(directory, None)
@@ -0,0 +1,14 @@
+import pytest
+
+from anthropic_computer_use.main import EditorSession
+
+
+@pytest.fixture
+def editor_session(tmp_path, monkeypatch):
+    # The shared client only needs a key to be constructed; no request is sent
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+    session = EditorSession(
+        editor_dir=str(tmp_path / "editor"), sessions_dir=str(tmp_path / "sessions")
+    )
+    yield session
+    session.close()
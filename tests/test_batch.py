@@ -0,0 +1,32 @@
+import pytest
+
+from anthropic_computer_use.batch import load_jobs
+
+
+def test_jobs_default_to_the_given_mode(tmp_path):
+    path = tmp_path / "jobs.jsonl"
+    path.write_text('"first"\n\n{"prompt": "second", "mode": "bash", "id": "b"}\n')
+
+    jobs = load_jobs(str(path), "editor")
+
+    assert jobs == [
+        {"prompt": "first", "mode": "editor", "id": "1"},
+        {"prompt": "second", "mode": "bash", "id": "b"},
+    ]
+
+
+@pytest.mark.parametrize(
+    "line, message",
+    [
+        ('{"prompt": "x", "mode": "bsh"}', "2: unknown mode 'bsh'"),
+        ("[1, 2]", "2: expected a prompt string or an object"),
+        ("42", "2: expected a prompt string or an object"),
+        ('{"mode": "bash"}', "2: missing 'prompt'"),
+    ],
+)
+def test_invalid_jobs_are_rejected_with_their_line(tmp_path, line, message):
+    path = tmp_path / "jobs.jsonl"
+    path.write_text(f'"ok"\n{line}\n')
+
+    with pytest.raises(ValueError, match=message):
+        load_jobs(str(path), "editor")
@@ -0,0 +1,18 @@
+from anthropic_computer_use.line_index import LineIndexCache
+
+
+def test_cache_keeps_only_the_most_recently_used_indexes(tmp_path):
+    cache = LineIndexCache(max_indexes=2)
+    paths = []
+    for name in "abc":
+        path = tmp_path / f"{name}.txt"
+        path.write_text("one\ntwo\n")
+        paths.append(str(path))
+
+    first = cache.get(paths[0])
+    cache.get(paths[1])
+    assert cache.get(paths[0]) is first
+    cache.get(paths[2])
+
+    assert set(cache._indexes) == {paths[0], paths[2]}
+    assert cache.get(paths[0]).read_lines(1, 2) == ["one", "two"]
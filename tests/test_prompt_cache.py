@@ -0,0 +1,34 @@
+from anthropic_computer_use.prompt_cache import EPHEMERAL, PROMPT_CACHING_BETA_FLAG
+
+
+def _user(text):
+    return {"role": "user", "content": [{"type": "text", "text": text}]}
+
+
+def test_cached_request_sends_beta_flag_and_breakpoints(editor_session):
+    editor_session.messages = [
+        _user("first"),
+        {"role": "assistant", "content": [{"type": "text", "text": "ok"}]},
+        _user("second"),
+    ]
+
+    params = editor_session._message_params()
+
+    assert params["betas"] == ["computer-use-2024-10-22", PROMPT_CACHING_BETA_FLAG]
+    assert params["system"][-1]["cache_control"] == EPHEMERAL
+    assert params["messages"][0]["content"][-1]["cache_control"] == EPHEMERAL
+    assert params["messages"][2]["content"][-1]["cache_control"] == EPHEMERAL
+    # The stored conversation is left without breakpoints
+    assert "cache_control" not in editor_session.messages[2]["content"][-1]
+
+
+def test_uncached_request_has_no_caching_beta(editor_session):
+    editor_session.configure(prompt_caching=False)
+    editor_session.messages = [_user("first")]
+
+    params = editor_session._message_params()
+
+    assert params["betas"] == ["computer-use-2024-10-22"]
+    assert "cache_control" not in params["messages"][0]["content"][-1]
+    # The class-level list is not modified
+    assert editor_session.betas == ["computer-use-2024-10-22"]
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from anthropic_computer_use.rate_limit import RateLimitScheduler
+
+PARAMS = {"model": "m", "max_tokens": 10, "messages": []}
+
+
+def _client(create):
+    return SimpleNamespace(
+        beta=SimpleNamespace(
+            messages=SimpleNamespace(with_raw_response=SimpleNamespace(create=create))
+        )
+    )
+
+
+def _raw():
+    return SimpleNamespace(headers={}, parse=lambda: "response")
+
+
+def test_cancelled_first_call_does_not_block_the_next():
+    scheduler = RateLimitScheduler()
+    started = asyncio.Event()
+    calls = []
+
+    async def create(**kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            started.set()
+            await asyncio.Event().wait()
+        return _raw()
+
+    async def scenario():
+        client = _client(create)
+        first = asyncio.create_task(scheduler.acreate(client, PARAMS))
+        await started.wait()
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        response, _ = await asyncio.wait_for(scheduler.acreate(client, PARAMS), 2)
+        return response
+
+    assert asyncio.run(scenario()) == "response"
+    assert len(calls) == 2
+
+
+def test_interrupted_first_call_does_not_block_the_next():
+    scheduler = RateLimitScheduler()
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            raise KeyboardInterrupt
+        return _raw()
+
+    client = _client(create)
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.create(client, PARAMS)
+
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(scheduler.create(client, PARAMS)[0]), daemon=True
+    )
+    thread.start()
+    thread.join(2)
+    assert results == ["response"]
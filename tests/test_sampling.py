@@ -0,0 +1,28 @@
+import json
+
+from anthropic_computer_use.main import BashSession, SessionLogger
+
+
+def test_sampled_out_tool_output_is_still_counted(tmp_path, monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+    sessions_dir = str(tmp_path / "sessions")
+    session = BashSession(cwd=str(tmp_path), sessions_dir=sessions_dir)
+    session_logger = SessionLogger(
+        session.session_id, sessions_dir, sample_rate=0.0, console=False
+    )
+    session.set_logger(session_logger)
+    try:
+        result = session._handle_bash_command(
+            {"command": "i=0; while ((i<20000)); do ((i++)); done; echo done"}
+        )
+    finally:
+        session.close()
+        session_logger.close()
+
+    assert result["content"] == "done"
+    with open(tmp_path / "sessions" / f"{session.session_id}.jsonl") as f:
+        events = [json.loads(line)["event"] for line in f]
+    assert "tool_output" not in events
+    counters = session_logger.metrics.to_dict()["counters"]
+    assert counters["tool_cpu_seconds_total"][0]["labels"] == {"command": "i=0;"}
+    assert session_logger.metrics.to_dict()["summary"]["tool_cpu_seconds"] >= 0
@@ -0,0 +1,22 @@
+from anthropic_computer_use.main import LINE_INDEX_THRESHOLD_BYTES, MAX_VIEW_BYTES
+
+
+def test_single_long_line_is_cut_to_the_view_budget(editor_session, tmp_path):
+    path = tmp_path / "minified.json"
+    path.write_text("x" * (LINE_INDEX_THRESHOLD_BYTES * 2))
+
+    content = editor_session._handle_view(str(path), {})["content"]
+
+    assert len(content) < MAX_VIEW_BYTES + 1024
+    assert f"showing its first {MAX_VIEW_BYTES} bytes" in content
+
+
+def test_long_line_below_the_index_threshold_is_cut_too(editor_session, tmp_path):
+    path = tmp_path / "dump.txt"
+    path.write_text("short\n" + "y" * (MAX_VIEW_BYTES * 2) + "\nlast\n")
+
+    content = editor_session._handle_view(str(path), {"view_range": [2, 3]})["content"]
+
+    assert len(content) < MAX_VIEW_BYTES + 1024
+    assert "Line 2 is" in content
+    assert "Showing lines 2-2 of 3" in content